@@ -17,15 +17,22 @@
 
 from __future__ import unicode_literals
 
-import glob
+import gzip
+import hashlib
 import json
 import os
 import platform
 import re
+import queue
 import string  # pylint: disable=W0402
 import sys
+import threading
+import time
 import traceback
-from datetime import datetime, timedelta
+from array import array
+from bisect import bisect_left, insort
+from collections import OrderedDict, deque, namedtuple
+from datetime import datetime
 
 import ac
 import acsys
@@ -34,12 +41,29 @@ sys.path.insert(
     0, 'apps/python/pitboard/pitboardDLL/%s/' % platform.architecture()[0]
 )
 
+from pitboardDLL import bestlaps, laps, png
 from pitboardDLL.sim_info import info
 
 # Customisable constants
 ZOOM_TRANSITION = 0.25
 TITLE_TIMEOUT = 10  # Time in seconds during which we show the title
 
+# Time (in ms) during which a car's best lap is polled after it started a
+# new lap, whatever the update rate
+BEST_LAP_POLL_TIME = 3000
+# Number of cars whose pit lane status is read per frame
+PIT_POLL_CARS = 4
+# Maximum memory (in bytes) used to keep the cars' past laps, see History
+HISTORY_MEMORY = 2 * 1024 * 1024
+# Number of laps of the leader's sector times kept to compute the gaps, the
+# gap of a car further behind is unknown
+LEADER_LAPS = 50
+# Spline distance above which a car is considered to have jumped (e.g. back
+# to the pits) between two updates, its laps aren't used as reference laps
+MAX_FRAME_DISTANCE = 0.02
+# Number of points at which the player's laps are timed, see LapTrace
+REFERENCE_LAP_POINTS = 1000
+
 # Default for settings that can be changed in game
 DETAILED_DELTA = True
 DISPLAY_TIMEOUT = 45
@@ -49,15 +73,46 @@ OPACITY = 0.8
 ORIENTATION_X = 'L'  # 'L' or 'R'
 ORIENTATION_Y = 'U'  # 'U' or 'D'
 SHORT_NAMES = False
+SECTORS_COUNT = 10  # Number of sectors used to measure the splits
+SECTORS_LENGTH = 0  # If set, length of the sectors in metres instead
 SMALLSIZE_SCALE = 0.5
 USE_SURNAME = False
 
 DEBUG = ac.getDriverName(0) == '0xdeadbee'
+DEBUG_LOG_PATH = 'apps/python/pitboard/debug.log'
+DEBUG_BUFFER_SIZE = 5000  # Number of debug messages kept in memory
+DEBUG_FLUSH_INTERVAL = 1.0  # Seconds between two writes to DEBUG_LOG_PATH
+DEBUG_DUMP_SECONDS = 10  # Seconds of debug messages logged on errors
+
+# Record every input read from the sim so the session can be replayed
+# offline with tools/replay.py
+RECORD = False
+
+# Time the hot path, the results are shown next to the widget and
+# periodically written to the log
+PROFILE = False
+PROFILE_LOG_INTERVAL = 30  # Time in seconds between summaries in the log
+PROFILE_SAMPLES = 600  # Number of frames used to compute the statistics
 
 APP_SIZE_X = 120 * FULLSIZE_SCALE
 APP_SIZE_Y = 30
 TEX_PATH = 'apps/python/pitboard/imgs/'
+GLYPHS_PATH = 'apps/python/pitboard/imgs/glyphs.json'  # See scan_glyphs
 PREFS_PATH = 'apps/python/pitboard/prefs.json'
+PREFS_SAVE_DELAY = 1.0  # Seconds without changes before the prefs are saved
+PREFS_SHUTDOWN_TIMEOUT = 2.0  # Seconds to wait for the prefs to be saved
+RECORDINGS_PATH = 'apps/python/pitboard/recordings/'
+REFERENCE_LAPS_PATH = 'apps/python/pitboard/laps/'  # See track_car_path
+BEST_LAPS_PATH = 'apps/python/pitboard/bestlaps/'  # See BestLapCache
+BEST_LAPS_SAVE_DELAY = 5.0  # Seconds without new best laps before saving
+
+# Compose each row of the board into a single texture, see RowCompositor
+COMPOSITE_ROWS = True
+ROWS_CACHE_PATH = 'apps/python/pitboard/cache/rows/'
+ROWS_CACHE_SIZE = 4 * 1024 * 1024  # Maximum size of the images on disk
+ROWS_TEXTURES_MEMORY = 16 * 1024 * 1024  # Maximum memory of the textures
+ROWS_COMPOSE_AFTER = 2  # Times a row is shown before it's composed
+ROWS_REQUESTS_MEMORY = 1000  # Rows remembered until they're shown again
 
 PREFS_KEYS = (
     'detailed_delta',
@@ -67,6 +122,8 @@ PREFS_KEYS = (
     'opacity',
     'orientation_x',
     'orientation_y',
+    'sectors_count',
+    'sectors_length',
     'short_names',
     'smallsize_scale',
     'use_surname',
@@ -82,6 +139,7 @@ COLOURS = {
 
 # Set default colour applied over cards' text texture
 DEFAULT_COLOUR = 'y'
+QUALI_REFERENCE_ROW = 5  # Row of the delta to the reference lap in quali
 
 # Mapping for special characters filenames
 CHARS_MAPS = {
@@ -117,33 +175,105 @@ QUALIFY = 1
 RACE = 2
 HOTLAP = 3
 
-
-# Define sectors frequency (0, 0.1, .., 0.9)
-SECTORS = [n / 100.0 for n in range(0, 100, 10)]
+# Events, see EventQueue
+SECTOR_CROSSED = 'sector_crossed'  # Value: index of the sector
+LAP_COMPLETED = 'lap_completed'  # Value: number of laps completed
+POSITION_CHANGED = 'position_changed'  # Value: new position
+PIT_ENTRY = 'pit_entry'
+PIT_EXIT = 'pit_exit'
+BEST_LAP_SET = 'best_lap_set'  # Value: best lap in ms
+DRIVER_CHANGED = 'driver_changed'  # Value: driver's name
+EVENTS = (SECTOR_CROSSED, LAP_COMPLETED, POSITION_CHANGED, PIT_ENTRY,
+          PIT_EXIT, BEST_LAP_SET, DRIVER_CHANGED)
+
+# Fields read from the shared memory and from ac.getCarState & co, these
+# are the ones saved by the Recorder
+RECORDING_VERSION = 1
+GRAPHICS_FIELDS = (
+    'packetId',
+    'status',
+    'session',
+    'completedLaps',
+    'iCurrentTime',
+    'iLastTime',
+    'sessionTimeLeft',
+    'distanceTraveled',
+    'isInPit',
+    'numberOfLaps',
+    'replayTimeMultiplier',
+    'normalizedCarPosition',
+)
+PHYSICS_FIELDS = (
+    'packetId',
+    'fuel',
+    'pitLimiterOn',
+)
+STATIC_FIELDS = (
+    'numCars',
+    'carModel',
+    'track',
+    'trackConfiguration',
+    'trackSPlineLength',
+    'isTimedRace',
+)
+CAR_FIELDS = (
+    'name',
+    'spline_pos',
+    'lap',
+    'best_lap',
+    'position',
+    'in_pit',
+)
 
 session = None
+profiler = None
+recorder = None
+
+
+def debug(msg, *args):
+    '''
+    Log a message, see DebugLog. It's only formatted with args when it's
+    written, if msg is a function the message is msg(*args).
+    '''
+    debug_log.add(msg, args)
 
 
-def debug(msg):
+def debug_cars(cars):
     '''
-    Log message to file
+    Return a string representation of the CarTable for logging. The table
+    is only copied (see CarTable.snapshot) when the message is written, so
+    it shows the cars at that time.
     '''
-    if DEBUG:
-        ac.log('Pitboard: %s' % msg)
+    s = ''
+    for index, name, position, spline_pos, best_lap, last_sector, \
+            next_sector in cars.snapshot():
+        s += '  Index: %d, Name: %s, Position: %d, Spline: %.2f, ' \
+            'Best: %s, Sectors: %d/%d\n' % (index, name, position, spline_pos,
+                                            best_lap or None, last_sector,
+                                            next_sector)
+
+    return s
 
 
-def debug_splits(splits):
+def debug_splits(names, splits):
     '''
     Return a string representation of the splits for logging
     '''
     s = ''
-    for car, split in splits.items():
-        s += '  %s (%s): %s\n' % (car.index, car.name,
-                                  split.total_seconds() if split else 'none')
+    for index, split in splits.items():
+        s += '  %s (%s): %s\n' % (index, names[index],
+                                  split if split is not None else 'none')
 
     return s
 
 
+def debug_text(text):
+    '''
+    Return a string representation of the board's text for logging
+    '''
+    return 'Text:\n %s \n' % '\n'.join([str(t) for t in text])
+
+
 def ms_to_str(ms, precise=True, arrows=False):
     '''
     Convert a time in milliseconds to a formatted string
@@ -168,16 +298,16 @@ def ms_to_str(ms, precise=True, arrows=False):
 
 def round_delta(delta):
     '''
-    Round the delta to seconds and deciseconds
+    Round the delta (in ms) to seconds and deciseconds
     '''
-    return timedelta(seconds=round(delta.total_seconds() * 10) / 10)
+    return round(delta / 100.0) * 100
 
 
 def split_to_str(split, arrows=False):
     '''
-    Convert a split (timedelta) to a formatted string
+    Convert a split (in ms) to a formatted string
     '''
-    return ms_to_str(split.total_seconds() * 1000, precise=False, arrows=arrows)
+    return ms_to_str(split, precise=False, arrows=arrows)
 
 
 def time_to_str(laptime, show_ms=True):
@@ -193,25 +323,454 @@ def time_to_str(laptime, show_ms=True):
         return '%d:%02d' % (m, s)
 
 
+class Recorder(object):
+    '''
+    Record the inputs used by acUpdate so that the session can be replayed
+    offline (see read_recording and tools/replay.py).
+
+    The recording is a gzipped file with a JSON header line followed by one
+    JSON line per frame:
+     [delta_t, cars_count, graphics, physics, static, cars]
+    graphics, physics and static are flat lists of [field index, value, ...]
+    containing only the fields which changed since the previous frame, cars
+    is a list of [car index, field index, value, ...] for the cars which
+    changed. cars_count is null if it hasn't changed.
+    '''
+    def __init__(self, path):
+        self.file = gzip.open(path, 'wt')
+        self.cars_count = None
+        self.cars = []
+        self.graphics = [None] * len(GRAPHICS_FIELDS)
+        self.physics = [None] * len(PHYSICS_FIELDS)
+        self.static = [None] * len(STATIC_FIELDS)
+
+        header = {
+            'version': RECORDING_VERSION,
+            'graphics': GRAPHICS_FIELDS,
+            'physics': PHYSICS_FIELDS,
+            'static': STATIC_FIELDS,
+            'car': CAR_FIELDS,
+        }
+        self._write(header)
+
+    def _delta(self, previous, current):
+        '''
+        Return a flat list of the indexes and values in current which
+        differ from previous, and update previous
+        '''
+        delta = []
+        for i, value in enumerate(current):
+            if value != previous[i]:
+                previous[i] = value
+                delta.extend((i, value))
+        return delta
+
+    def _write(self, data):
+        self.file.write(json.dumps(data, separators=(',', ':')))
+        self.file.write('\n')
+
+    def close(self):
+        self.file.close()
+
+    def record_frame(self, delta_t):
+        graphics, physics = info.snapshot()
+        static = info.static_snapshot()
+
+        graphics = self._delta(
+            self.graphics,
+            [getattr(graphics, field) for field in GRAPHICS_FIELDS])
+        physics = self._delta(
+            self.physics,
+            [getattr(physics, field) for field in PHYSICS_FIELDS])
+        static = self._delta(
+            self.static,
+            [getattr(static, field) for field in STATIC_FIELDS])
+
+        cars_count = ac.getCarsCount()
+        cars = []
+        for i in range(cars_count):
+            current = [
+                ac.getDriverName(i),
+                ac.getCarState(i, acsys.CS.NormalizedSplinePosition),
+                ac.getCarState(i, acsys.CS.LapCount),
+                ac.getCarState(i, acsys.CS.BestLap),
+                ac.getCarLeaderboardPosition(i),
+                ac.isCarInPitline(i),
+            ]
+            if i >= len(self.cars):
+                self.cars.append([None] * len(CAR_FIELDS))
+            delta = self._delta(self.cars[i], current)
+            if delta:
+                cars.append([i] + delta)
+
+        if cars_count == self.cars_count:
+            cars_count = None
+        else:
+            self.cars_count = cars_count
+
+        self._write([delta_t, cars_count, graphics, physics, static, cars])
+
+
+class DebugLog(object):
+    '''
+    Keep the debug messages of the last seconds in memory (see dump), and
+    write them to path from a background thread when enabled.
+    The messages are only formatted when they're written (or dumped), so
+    their arguments mustn't be modified once logged.
+    '''
+    def __init__(self, path=DEBUG_LOG_PATH, size=DEBUG_BUFFER_SIZE,
+                 interval=DEBUG_FLUSH_INTERVAL, enabled=DEBUG,
+                 seconds=DEBUG_DUMP_SECONDS):
+        self.path = path
+        self.interval = interval
+        self.enabled = enabled
+        self.seconds = seconds
+        self.records = deque(maxlen=size)  # (time, msg, args), see dump
+        self.pending = deque(maxlen=size)  # Records to write to path
+        self.dumped = 0  # Time of the last record dumped
+        self.thread = None
+
+    @staticmethod
+    def _format(record):
+        timestamp, msg, args = record
+        try:
+            if callable(msg):
+                text = msg(*args)
+            elif args:
+                text = msg % args
+            else:
+                text = '%s' % (msg, )
+        except Exception as e:  # pylint: disable=W0703
+            text = '%r %r (%s)' % (msg, args, e)
+
+        return '%s.%03d Pitboard: %s\n' % (
+            time.strftime('%H:%M:%S', time.localtime(timestamp)),
+            timestamp * 1000 % 1000, text)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.flush()
+
+    def add(self, msg, args):
+        record = (time.time(), msg, args)
+        records = self.records
+        records.append(record)
+        # Older messages can't be dumped
+        start = record[0] - self.seconds
+        while records[0][0] < start:
+            records.popleft()
+
+        if self.enabled:
+            self.pending.append(record)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run)
+                self.thread.daemon = True
+                self.thread.start()
+
+    def dump(self):
+        '''
+        Return the messages of the last seconds, except those already
+        dumped (e.g. when an error happens on every frame)
+        '''
+        start = max(time.time() - self.seconds, self.dumped)
+        records = [record for record in list(self.records)
+                   if record[0] > start]
+        if records:
+            self.dumped = records[-1][0]
+        return ''.join(self._format(record) for record in records)
+
+    def flush(self):
+        '''
+        Write the pending messages to the file
+        '''
+        lines = []
+        while self.pending:
+            lines.append(self._format(self.pending.popleft()))
+
+        if lines:
+            try:
+                with open(self.path, 'a') as f:
+                    f.write(''.join(lines))
+            except Exception:  # pylint: disable=W0703
+                # Don't let the log get in the way
+                self.enabled = False
+
+
+debug_log = DebugLog()
+
+
+def read_recording(path):
+    '''
+    Read a file written by Recorder, yields for each frame:
+     (delta_t, cars_count, graphics, physics, static, cars)
+    where graphics, physics and static are dicts of the changed fields, and
+    cars a dict of {car index: dict of changed fields}.
+    cars_count is None if it hasn't changed
+    '''
+    def fields(names, delta):
+        return dict((names[delta[i]], delta[i + 1])
+                    for i in range(0, len(delta), 2))
+
+    with gzip.open(path, 'rt') as f:
+        header = json.loads(f.readline())
+        if header.get('version') != RECORDING_VERSION:
+            raise ValueError('Unsupported recording version: %s' %
+                             header.get('version'))
+
+        for line in f:
+            delta_t, cars_count, graphics, physics, static, cars = \
+                json.loads(line)
+            yield (
+                delta_t,
+                cars_count,
+                fields(header['graphics'], graphics),
+                fields(header['physics'], physics),
+                fields(header['static'], static),
+                dict((car[0], fields(header['car'], car[1:]))
+                     for car in cars),
+            )
+
+
+class Clock(object):
+    '''
+    Monotonic clock in milliseconds used to timestamp the sectors.
+    The clock follows the game time when ticked with the frame time given to
+    acUpdate, and falls back on time.perf_counter otherwise.
+    '''
+    def __init__(self):
+        self.now = 0.0
+        self.start = time.perf_counter()
+
+    def tick(self, delta_t=None):
+        '''
+        Advance the clock by delta_t seconds, or to the current
+        performance counter if delta_t is None
+        '''
+        if delta_t is not None:
+            self.now += delta_t * 1000
+        else:
+            self.now = max(self.now,
+                           (time.perf_counter() - self.start) * 1000)
+
+
+class RollingStats(object):
+    '''
+    Keep the last samples of a value to compute its percentiles
+    '''
+    def __init__(self, size=PROFILE_SAMPLES):
+        self.samples = deque(maxlen=size)
+
+    def add(self, value):
+        self.samples.append(value)
+
+    def summary(self):
+        '''
+        Return p50, p99 and max of the samples
+        '''
+        if not self.samples:
+            return 0, 0, 0
+        samples = sorted(self.samples)
+        return (
+            samples[len(samples) // 2],
+            samples[min(len(samples) - 1, int(len(samples) * 0.99))],
+            samples[-1],
+        )
+
+
+class QuadCounter(object):
+    '''
+    Stand-in for the ac module which counts the calls to glQuadTextured,
+    other functions are looked up in the real module
+    '''
+    def __init__(self, module):
+        self.module = module
+        self.quads = 0
+
+    def __getattr__(self, name):
+        value = getattr(self.module, name)
+        setattr(self, name, value)
+        return value
+
+    def glQuadTextured(self, *args):
+        self.quads += 1
+        return self.module.glQuadTextured(*args)
+
+
+class Profiler(object):
+    '''
+    Time the functions of the hot path and count the number of textured
+    quads per frame, the results are displayed in a label next to the
+    widget and written to the log every PROFILE_LOG_INTERVAL seconds
+    '''
+    def __init__(self):
+        self.label = None
+        self.last_log = time.perf_counter()
+        self.last_overlay = self.last_log
+        self.quads = RollingStats()
+        self.stats = []
+        self.counter = None
+
+    def _wrap(self, owner, name):
+        '''
+        Replace owner.name with a function recording its execution time,
+        owner is None for functions of this module
+        '''
+        namespace = globals() if owner is None else owner.__dict__
+        function = namespace[name]
+        stats = RollingStats()
+        self.stats.append(('%s.%s' % (owner.__name__, name) if owner
+                           else name, stats))
+        perf_counter = time.perf_counter
+
+        def timed(*args):
+            start = perf_counter()
+            try:
+                return function(*args)
+            finally:
+                stats.add((perf_counter() - start) * 1000)
+
+        if owner is None:
+            globals()[name] = timed
+        else:
+            setattr(owner, name, timed)
+
+    def _wrap_render_callback(self):
+        '''
+        Count the quads drawn by each call to render_callback
+        '''
+        function = globals()['render_callback']
+        counter = self.counter
+        quads = self.quads
+
+        def counted(delta_t):
+            counter.quads = 0
+            function(delta_t)
+            quads.add(counter.quads)
+
+        globals()['render_callback'] = counted
+
+    def install(self):
+        '''
+        Wrap the hot path functions, must be called before the widget is
+        created so that the render callback is wrapped as well
+        '''
+        global ac  # pylint: disable=W0601,W0603
+
+        self.counter = QuadCounter(ac)
+        ac = self.counter
+
+        for owner, name in (
+                (Session, 'update_data'),
+                (Session, '_update_cars'),
+                (EventQueue, 'dispatch'),
+                (Session, 'update_board'),
+                (UI, 'update_ui'),
+                (None, 'render_callback')):
+            self._wrap(owner, name)
+        self._wrap_render_callback()
+
+    def create_overlay(self, widget):
+        self.label = ac.addLabel(widget, '')
+        ac.setPosition(self.label, APP_SIZE_X + 10, 0)
+        ac.setFontSize(self.label, 12)
+
+    def summary(self):
+        '''
+        Return the statistics as a list of lines
+        '''
+        lines = ['%-24s %6s %6s %6s' % ('ms', 'p50', 'p99', 'max')]
+        for name, stats in self.stats:
+            lines.append('%-24s %6.3f %6.3f %6.3f' % ((name, ) +
+                                                      stats.summary()))
+        lines.append('%-24s %6d %6d %6d' % (('quads/frame', ) +
+                                            self.quads.summary()))
+        if session:
+            lines.append('%-24s %6d KB, %d laps' % (
+                'history', session.history.memory() // 1024,
+                session.history.laps_count))
+        return lines
+
+    def update(self):
+        '''
+        Called on acUpdate, refresh the overlay every second and write to
+        the log every PROFILE_LOG_INTERVAL seconds
+        '''
+        now = time.perf_counter()
+        if now - self.last_overlay < 1:
+            return
+        self.last_overlay = now
+
+        lines = self.summary()
+        if self.label is not None:
+            ac.setText(self.label, '\n'.join(lines))
+
+        if now - self.last_log >= PROFILE_LOG_INTERVAL:
+            self.last_log = now
+            ac.log('Pitboard: timings\n%s' % '\n'.join(lines))
+
+
+# Something that happened to a car during a frame, time is the time of the
+# session's clock (in ms) and value depends on the type, see EVENTS
+Event = namedtuple('Event', ('type', 'car', 'time', 'value'))
+
+
+class EventQueue(object):
+    '''
+    Collect the events of a frame, and pass them to the functions which
+    subscribed to their type once the frame's data has been updated
+    '''
+    def __init__(self):
+        self.events = []
+        self.subscribers = dict((event_type, []) for event_type in EVENTS)
+
+    def clear(self):
+        self.events = []
+
+    def dispatch(self):
+        '''
+        Call the subscribers of the events emitted since the last call
+        '''
+        events = self.events
+        if not events:
+            return
+
+        self.events = []
+        subscribers = self.subscribers
+        for event in events:
+            for callback in subscribers[event.type]:
+                callback(event)
+
+    def emit(self, event_type, car, time_, value=None):
+        self.events.append(Event(event_type, car, time_, value))
+
+    def subscribe(self, event_type, callback):
+        '''
+        Call callback(event) for every event of the given type
+        '''
+        self.subscribers[event_type].append(callback)
+
+
 class Car(object):
     '''
-    Store information about car
+    View of a car's row in the CarTable, used to build the board and for
+    debugging
     '''
-    def __init__(self, index, name, _session, session_type):
-        self.best_lap = None
+    __slots__ = ('index', 'table')
+
+    def __init__(self, table, index):
         self.index = index
-        self.lap = -1
-        self.name = name
-        self.position = -1
-        self.session = _session
-        self.spline_pos = 0
+        self.table = table
+
+    def __eq__(self, other):
+        return isinstance(other, Car) and self.index == other.index and \
+            self.table is other.table
 
-        if session_type == RACE:
-            self.last_sector = None
-            self.next_sector = None
-            # Create a dict of sectors and timestamps
-            # {0: None, 0.1: None, ... 0.9: None}
-            self.sectors = dict([(x, None) for x in SECTORS])
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return self.index
 
     def __repr__(self):
         data = [
@@ -221,7 +780,7 @@ class Car(object):
             'Spline: %.2f' % self.spline_pos,
             'Best: %s' % self.best_lap
         ]
-        if hasattr(self, 'last_sector'):
+        if self.next_sector is not None:
             data.extend([
                 'Last sector: %s' % self.last_sector,
                 'Next sector: %s' % self.next_sector,
@@ -229,111 +788,1253 @@ class Car(object):
             ])
         return ', '.join(data)
 
-    def _update_data_race(self):
-        '''
-        Update race specific data
-        '''
-        # Check if we've started a new sector, and store the current timestamp
-        if self.next_sector is None:
-            self._set_next_sector(self.spline_pos)
-        else:
-            spline_pos = self.spline_pos
+    @property
+    def best_lap(self):
+        return self.table.best_lap[self.index] or None
+
+    @property
+    def cached_best(self):
+        return self.table.cached_best[self.index] or None
 
-            # Workaround to handle the last sector (0.96 is the same position
-            # as -0.04)
-            if self.next_sector == 0 and spline_pos >= max(SECTORS):
-                spline_pos -= 1
+    @property
+    def lap(self):
+        return self.table.lap[self.index]
 
-            if spline_pos >= self.next_sector:
-                # Store the current timestamp
-                self.sectors[self.next_sector] = datetime.now()
+    @property
+    def last_sector(self):
+        sector = self.table.last_sector[self.index]
+        return self.table.get_sector_start(sector) if sector != -1 else None
 
-                # Store the last known sector and set the next expected
-                self.last_sector = self.next_sector
-                self._set_next_sector(spline_pos)
+    @property
+    def name(self):
+        return self.table.names[self.index]
 
-    def _set_next_sector(self, spline):
+    @property
+    def next_sector(self):
+        sector = self.table.next_sector[self.index]
+        return self.table.get_sector_start(sector) if sector != -1 else None
+
+    @property
+    def position(self):
+        return self.table.position[self.index]
+
+    @property
+    def sectors(self):
         '''
-        Set next_sector based on the given spline
-        0.01 -> 0.05, 0.05 -> 0.1
+        Return a dict of sectors and timestamps, e.g. for 10 sectors:
+        {0: None, 0.1: None, ... 0.9: None}
         '''
-        try:
-            self.next_sector = [x for x in SECTORS if x > spline][0]
-        except IndexError:
-            self.next_sector = 0
+        count = self.table.sectors_count
+        start = self.index * count
+        times = self.table.sector_times[start:start + count]
+        return dict((self.table.get_sector_start(sector),
+                     time_ if time_ >= 0 else None)
+                    for sector, time_ in enumerate(times))
+
+    @property
+    def spline_pos(self):
+        return self.table.spline_pos[self.index]
 
     def get_name(self):
         '''
         Returns the driver's name
         '''
-        if self.session.use_surname and ' ' in self.name:
+        if self.table.session.use_surname and ' ' in self.name:
             name = self.name.split()[1]
         else:
             name = self.name
 
-        if self.session.short_names:
+        if self.table.session.short_names:
             return name[:3]
         else:
             return name
 
-    def update_data(self, session_type):
-        self.spline_pos = ac.getCarState(
-            self.index, acsys.CS.NormalizedSplinePosition)
-        self.lap = ac.getCarState(self.index, acsys.CS.LapCount)
 
-        # The name can change if in no-booking mode
-        self.name = ac.getDriverName(self.index)
+class CarTable(object):
+    '''
+    Store information about all the cars, with one array per field and one
+    row per car slot (the car's index in ac).
+    Indexing or iterating over the table returns Car views.
+
+    The track is split in sectors_count sectors of the same length, sector
+    s starts at the spline position s / sectors_count.
 
-        if session_type == RACE:
-            self._update_data_race()
+    The changes are emitted as events (see EVENTS) in the events queue.
+    '''
+    def __init__(self, _session, sectors_count=SECTORS_COUNT, events=None,
+                 history=None):
+        self.session = _session
+        self.sectors_count = sectors_count
+        self.events = events if events is not None else EventQueue()
+        self.history = history  # History of the cars' laps, if any
+        self.names = []
+        self.best_lap = array('i')  # 0 if unknown
+        # Best lap of the driver in past sessions, 0 if unknown, see
+        # BestLapCache
+        self.cached_best = array('i')
+        self.lap = array('i')
+        self.position = array('i')
+        # Position in ac's leaderboard, which knows the laps set before we
+        # joined, 0 if unknown. It orders the cars without a best lap
+        # outside of races (see sort_best_lap_order), and is only read when
+        # a car changes driver, or for all of them when a lap is completed
+        # or a best lap is set
+        self.ac_position = array('i')
+        self.spline_pos = array('d')
+
+        # Spline positions and time (in ms) of the previous update, used to
+        # interpolate the time at which the cars crossed the sectors
+        self.previous_spline_pos = array('d')
+        self.previous_time = -1
+        self.time = -1
+
+        # Spline positions between which the cars stay in the same sector,
+        # only the cars outside of them are checked by _update_sectors
+        self.sector_low = array('d')
+        self.sector_high = array('d')
+
+        # Index of the cars by position: order[p - 1] is the index of the car
+        # in position p, -1 if unknown
+        self.order = array('i')
+
+        # Most values only change once per lap at most, they are only read
+        # from ac when needed:
+        #  - the best laps of the cars which started a new lap in the last
+        #    BEST_LAP_POLL_TIME ms, {car index: time at which polling stops,
+        #    None until the first poll}, outside
+        #    of races the positions follow the best laps (see leaderboard)
+        #  - one driver's name per frame, or when the slot changes driver
+        #  - the pit lane status of PIT_POLL_CARS cars per frame, the
+        #    player's is given on every frame (see update)
+        self.best_lap_polls = {}
+        self.positions_dirty = True
+        self.next_name = 0
+        self.next_pit = 0
+
+        # 1 if the car is in the pit lane, 0 if not, -1 if unknown
+        self.in_pit = array('b')
+
+        # Best laps sorted, used for the positions outside of races
+        self.leaderboard = Leaderboard()
+
+        # Index of the last and next sectors, -1 if unknown
+        self.last_sector = array('i')
+        self.next_sector = array('i')
+        # Number of sectors' starts the cars went back over (e.g. rolling
+        # back), they were already started and are skipped when the cars
+        # cross them again, so that only the next sector is started
+        self.rewound = array('i')
+
+        # Time (from Session.clock, in ms) at which the cars crossed each
+        # sector, -1 if unknown, the time for car i and sector s is at
+        # i * sectors_count + s
+        self.sector_times = array('d')
+
+        # Time (in ms) behind the leader when the cars crossed each sector
+        # during the last lap, -1 if unknown, see _update_gap and get_gap.
+        # The gap for car i at sector s is at i * sectors_count + s
+        self.gaps = array('d')
+        # Number of sectors started since the start of the session when the
+        # cars crossed their last sector (laps * sectors_count + sector),
+        # -1 if unknown
+        self.crossings = array('i')
+        # Time at which the first car (the leader) started each sector for
+        # the last LEADER_LAPS laps, the time for crossing c is at
+        # c % len(leader_times) if leader_crossings holds c at that index
+        self.leader_crossings = array('i', [-1] * LEADER_LAPS * sectors_count)
+        self.leader_times = array('d', [0] * LEADER_LAPS * sectors_count)
+
+    def __getitem__(self, index):
+        if not 0 <= index < len(self.names):
+            raise IndexError('No car at index %d' % index)
+        return Car(self, index)
+
+    def __iter__(self):
+        return (Car(self, i) for i in range(len(self.names)))
+
+    def __len__(self):
+        return len(self.names)
+
+    def _update_gap(self, index, sector, time_, lap):
+        '''
+        Update the time behind the leader of the car at index, which
+        started sector at time_ with lap laps completed
+        '''
+        sectors_count = self.sectors_count
+        crossing = self.crossings[index]
+
+        if crossing == -1:
+            # The lap count can be updated a frame after the car crossed the
+            # finish line, start counting from the next sector
+            if not sector:
+                return
+            crossing = lap * sectors_count + sector
         else:
-            self.position = ac.getCarLeaderboardPosition(self.index)
-            best_lap = ac.getCarState(self.index, acsys.CS.BestLap)
-            if best_lap > 0:
-                self.best_lap = best_lap
+            step = (sector - crossing) % sectors_count
+            if not step and sectors_count > 1:
+                # The car already started this sector, the repeat is ignored
+                return
+            crossing += step or sectors_count
+        self.crossings[index] = crossing
+
+        if self.history:
+            self.history.record(index, crossing, time_)
+
+        slot = crossing % len(self.leader_times)
+        leader_crossing = self.leader_crossings[slot]
+        if leader_crossing == crossing:
+            gap = time_ - self.leader_times[slot]
+        elif leader_crossing < crossing:
+            # First car to get there
+            self.leader_crossings[slot] = crossing
+            self.leader_times[slot] = time_
+            gap = 0
+        else:
+            # The leader is more than LEADER_LAPS laps ahead
+            gap = -1
+        self.gaps[index * sectors_count + sector] = gap
+
+    def get_gap(self, index, other):
+        '''
+        Return the time (in ms) between the cars at index and other
+        (positive if index is behind), or None if unknown.
+        It's the difference of their gaps to the leader at the last sector
+        both crossed, or at their own last sectors if they're more than a
+        lap apart.
+        '''
+        crossing = self.crossings[index]
+        other_crossing = self.crossings[other]
+        if crossing == -1 or other_crossing == -1:
+            return None
+
+        sectors_count = self.sectors_count
+        if abs(crossing - other_crossing) < sectors_count:
+            crossing = other_crossing = min(crossing, other_crossing)
+
+        gap = self.gaps[index * sectors_count + crossing % sectors_count]
+        other_gap = self.gaps[other * sectors_count +
+                              other_crossing % sectors_count]
+        if gap < 0 or other_gap < 0:
+            return None
+        return gap - other_gap
+
+    def _update_pits(self, count, now, player_in_pit=-1):
+        '''
+        Read the pit lane status of the next PIT_POLL_CARS cars, the
+        player's is player_in_pit if known (not -1)
+        '''
+        in_pit = self.in_pit
+        emit = self.events.emit
+
+        statuses = []
+        first = 0
+        if player_in_pit != -1:
+            statuses.append((0, player_in_pit))
+            first = 1
+        polled = count - first
+        for _ in range(min(PIT_POLL_CARS, polled)):
+            i = first + self.next_pit % polled
+            self.next_pit = i + 1 - first
+            statuses.append((i, 1 if ac.isCarInPitline(i) else 0))
+
+        for i, status in statuses:
+            if status != in_pit[i]:
+                if in_pit[i] != -1:
+                    emit(PIT_ENTRY if status else PIT_EXIT, i, now)
+                in_pit[i] = status
+
+    def _update_sectors(self, moved, now):
+        '''
+        Check if the cars at the indexes in moved, which left the sector
+        they were in, have started one or more sectors since the last
+        update, and store the time at which they did, interpolated from the
+        previous and current spline positions.
+        The sectors' starts a car goes back over aren't started again when
+        it drives forward over them, see rewound.
+        '''
+        if not moved:
+            return
+
+        emit = self.events.emit
+        update_gap = self._update_gap
+        lap = self.lap
+        spline_pos = self.spline_pos
+        previous_spline_pos = self.previous_spline_pos
+        previous_time = self.previous_time
+        frame_time = now - previous_time
+        last_sector = self.last_sector
+        next_sector = self.next_sector
+        rewound = self.rewound
+        sector_times = self.sector_times
+        sector_low = self.sector_low
+        sector_high = self.sector_high
+        sectors_count = self.sectors_count
+        last = sectors_count - 1
+
+        for i in moved:
+            position = spline_pos[i]
+            previous = previous_spline_pos[i]
+            sector = next_sector[i]
+
+            # Index of the sector the car is in, and its bounds slightly
+            # narrowed so that no change of index can be missed
+            current = min(int(position * sectors_count), last)
+            sector_low[i] = current / float(sectors_count)
+            sector_high[i] = (current + 1) / float(sectors_count) - 1e-9 \
+                if current != last else 2
+
+            if sector == -1:
+                next_sector[i] = current + 1 if current != last else 0
+                continue
+
+            # Distance travelled since the last update, the spline position
+            # goes back to 0 on the finish line, and to 1 when the car goes
+            # back over it
+            distance = position - previous
+            if distance < -0.5:
+                distance += 1
+            elif distance > 0.5:
+                distance -= 1
+
+            if 0 < distance < 0.5 and previous_time >= 0:
+                # Every sector whose start is between the previous and
+                # current positions has been started, at the time the car
+                # was on it assuming a constant speed since the last update
+                end = (previous + distance) * sectors_count
+                boundary = int(previous * sectors_count) + 1
+                while rewound[i] and boundary <= end:
+                    rewound[i] -= 1
+                    boundary += 1
+                if boundary > end:
+                    continue
+
+                while boundary <= end:
+                    sector = boundary % sectors_count
+                    time_ = previous_time + frame_time * \
+                        (boundary / sectors_count - previous) / distance
+                    sector_times[i * sectors_count + sector] = time_
+                    # The lap count already includes the finish line if it
+                    # was crossed after this sector
+                    update_gap(i, sector, time_, lap[i] - 1
+                               if boundary < sectors_count <= end else lap[i])
+                    emit(SECTOR_CROSSED, i, time_, sector)
+                    boundary += 1
+
+            elif -MAX_FRAME_DISTANCE <= distance < 0:
+                # The car went back, count the starts it went over, a jump
+                # (e.g. back to the pits) is handled below
+                rewound[i] += int(previous * sectors_count) - \
+                    int((previous + distance) * sectors_count // 1)
+                continue
+
+            # The first sector is only started once the car has left the
+            # last one (0.96 is the same position as -0.04)
+            elif (current >= sector) if sector else (current != last):
+                # Store the current time
+                rewound[i] = 0
+                sector_times[i * sectors_count + sector] = now
+                update_gap(i, sector, now, lap[i])
+                emit(SECTOR_CROSSED, i, now, sector)
+
+            else:
+                continue
+
+            # Store the last known sector and set the next expected
+            last_sector[i] = sector
+            next_sector[i] = current + 1 if current != last else 0
+
+    def add(self, name):
+        '''
+        Add a row for the next car slot
+        '''
+        index = len(self.names)
+        self.best_lap_polls[index] = None
+        self.positions_dirty = True
+        self.events.emit(DRIVER_CHANGED, index, self.time, name)
+        self.names.append(name)
+        self.cached_best.append(0)
+        if self.history:
+            self.history.add_car()
+        self.best_lap.append(0)
+        self.lap.append(-1)
+        self.position.append(-1)
+        self.spline_pos.append(0)
+        self.sector_low.append(0)
+        self.sector_high.append(0)
+        self.in_pit.append(-1)
+        self.last_sector.append(-1)
+        self.next_sector.append(-1)
+        self.rewound.append(0)
+        self.sector_times.extend([-1] * self.sectors_count)
+        self.gaps.extend([-1] * self.sectors_count)
+        self.crossings.append(-1)
+        self.ac_position.append(0)
+        self._update_ac_position(index)
+
+    def _set_name(self, index, name):
+        '''
+        Set the driver's name of the car at index, its best lap from past
+        sessions is forgotten if the driver changed
+        '''
+        if name != self.names[index]:
+            self.names[index] = name
+            self.set_cached_best(index, 0)
+            self._update_ac_position(index)
+            self.events.emit(DRIVER_CHANGED, index, self.time, name)
+
+    def _update_ac_position(self, index):
+        '''
+        Read the position of the car at index in ac's leaderboard
+        '''
+        position = max(0, ac.getCarLeaderboardPosition(index))
+        if position != self.ac_position[index]:
+            self.ac_position[index] = position
+            if not self.best_lap[index]:
+                self.positions_dirty = True
+
+    def set_cached_best(self, index, lap_time):
+        '''
+        Set the best lap (in ms, 0 if unknown) of the driver of the car at
+        index in past sessions, it's used to order the cars without a lap
+        in this session
+        '''
+        if lap_time != self.cached_best[index]:
+            self.cached_best[index] = lap_time
+            self.positions_dirty = True
+
+    def get_index_by_position(self, position):
+        '''
+        Return the index of the car in the given position, or -1
+        '''
+        if 0 < position <= len(self.order):
+            return self.order[position - 1]
+        return -1
+
+    def sort_best_lap_order(self, now):
+        '''
+        Update the positions of the cars from the leaderboard, the cars
+        without a best lap come last, by position in ac's leaderboard (e.g.
+        for the laps set before we joined), best lap in past sessions then
+        index
+        '''
+        best_lap = self.best_lap
+        cached_best = self.cached_best
+        ac_position = self.ac_position
+        order = self.leaderboard.get_indexes() + sorted(
+            (i for i in range(len(self.names)) if not best_lap[i]),
+            key=lambda i: (not ac_position[i], ac_position[i],
+                           not cached_best[i], cached_best[i], i))
+
+        position = self.position
+        emit = self.events.emit
+        for p, index in enumerate(order, 1):
+            if position[index] != p:
+                position[index] = p
+                emit(POSITION_CHANGED, index, now, p)
+
+        self.order = array('i', order)
+
+    def sort_race_order(self, now):
+        '''
+        Update the race position of the cars based on their lap and
+        spline position.
+        The order only changes by a few swaps between two frames, so the
+        previous order is kept and fixed with an insertion sort.
+        '''
+        order = self.order
+        position = self.position
+        progress = [lap + spline_pos for lap, spline_pos in
+                    zip(self.lap, self.spline_pos)]
+        moved = {}  # {car index: previous position}
+
+        # New cars start at the back
+        for i in range(len(order), len(self.names)):
+            order.append(i)
+            moved[i] = position[i]
+            position[i] = len(order)
+
+        for j in range(1, len(order)):
+            index = order[j]
+            value = progress[index]
+            if progress[order[j - 1]] >= value:
+                continue
+
+            # Move the car up until the car ahead is further on track
+            k = j - 1
+            while k >= 0 and progress[order[k]] < value:
+                order[k + 1] = order[k]
+                moved.setdefault(order[k + 1], position[order[k + 1]])
+                position[order[k + 1]] = k + 2
+                k -= 1
+            order[k + 1] = index
+            moved.setdefault(index, position[index])
+            position[index] = k + 2
+
+        emit = self.events.emit
+        for index, previous in moved.items():
+            if position[index] != previous:
+                emit(POSITION_CHANGED, index, now, position[index])
+
+    def snapshot(self):
+        '''
+        Return a copy of the cars' index, name, position, spline position,
+        best lap, last and next sectors for logging, see debug_cars
+        '''
+        return tuple(zip(range(len(self.names)), self.names, self.position,
+                         self.spline_pos, self.best_lap, self.last_sector,
+                         self.next_sector))
+
+    def get_sector_start(self, sector):
+        '''
+        Return the spline position at which the given sector starts
+        '''
+        return sector / float(self.sectors_count)
+
+    def update(self, count, session_type, now, player_in_pit=-1):
+        '''
+        Update the data of the first count cars, now is the current time
+        in ms. player_in_pit is 1 if the player is in the pits, 0 if not, as
+        read on every frame from the graphics page, or -1 if unknown.
+        '''
+        count = min(count, len(self.names))
+        get_car_state = ac.getCarState
+        spline_pos_state = acsys.CS.NormalizedSplinePosition
+        lap_count_state = acsys.CS.LapCount
+        best_lap_polls = self.best_lap_polls
+        lap = self.lap
+        spline_pos = self.spline_pos
+
+        self.previous_spline_pos = spline_pos[:]
+        self.previous_time = self.time
+        self.time = now
+        completed = False
+
+        for i in range(count):
+            spline_pos[i] = get_car_state(i, spline_pos_state)
+            current_lap = get_car_state(i, lap_count_state)
+
+            if current_lap != lap[i]:
+                if current_lap < lap[i]:
+                    # The name can change if in no-booking mode
+                    self._set_name(i, ac.getDriverName(i))
+                    self.best_lap[i] = 0
+                    if self.leaderboard.remove(i):
+                        self.positions_dirty = True
+                elif lap[i] != -1:
+                    self.events.emit(LAP_COMPLETED, i, now, current_lap)
+                    completed = True
+                lap[i] = current_lap
+                best_lap_polls[i] = now + BEST_LAP_POLL_TIME
+
+        if count:
+            # Refresh one name per frame in case the driver changed
+            i = self.next_name % count
+            self._set_name(i, ac.getDriverName(i))
+            self.next_name = i + 1
+
+            self._update_pits(count, now, player_in_pit)
+
+        # Only the cars which left their sector can have crossed one
+        moved = [i for i, position, low, high in
+                 zip(range(count), spline_pos, self.sector_low,
+                     self.sector_high)
+                 if not low <= position < high]
+        self._update_sectors(moved, now)
+        if session_type != RACE:
+            self._update_best_laps(count, now, completed)
+
+    def _update_best_laps(self, count, now, completed=False):
+        '''
+        Poll the best laps of the cars which recently started a new lap,
+        and update the positions if any of them changed or a car completed
+        a lap
+        '''
+        best_lap_state = acsys.CS.BestLap
+        best_lap = self.best_lap
+        best_lap_polls = self.best_lap_polls
+
+        for i, deadline in list(best_lap_polls.items()):
+            if i >= count:
+                continue
+            if deadline is None:
+                deadline = best_lap_polls[i] = now + BEST_LAP_POLL_TIME
+
+            lap_time = ac.getCarState(i, best_lap_state)
+            if lap_time > 0 and lap_time != best_lap[i]:
+                best_lap[i] = lap_time
+                self.leaderboard.update(i, lap_time)
+                self.events.emit(BEST_LAP_SET, i, now, lap_time)
+                self.positions_dirty = True
+                completed = True
+                del best_lap_polls[i]
+            elif now >= deadline:
+                del best_lap_polls[i]
+
+        if completed:
+            # ac's leaderboard may have changed
+            for i in range(count):
+                if not best_lap[i]:
+                    self._update_ac_position(i)
+
+        if self.positions_dirty:
+            self.positions_dirty = False
+            self.sort_best_lap_order(now)
+
+
+class Leaderboard(object):
+    '''
+    The cars' best laps in ms, sorted from the fastest, updated with bisect
+    when a car sets a new best lap
+    '''
+    def __init__(self):
+        self.entries = []  # (best lap, car index)
+        self.best_laps = {}  # {car index: best lap}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _get_rank(self, index):
+        '''
+        Return the position - 1 of the car at index, or -1
+        '''
+        try:
+            best_lap = self.best_laps[index]
+        except KeyError:
+            return -1
+        return bisect_left(self.entries, (best_lap, index))
+
+    def get_gap_to_ahead(self, index):
+        '''
+        Return the gap (in ms) between the car at index and the car ahead,
+        or None
+        '''
+        rank = self._get_rank(index)
+        if rank < 1:
+            return None
+        return self.entries[rank][0] - self.entries[rank - 1][0]
+
+    def get_gap_to_pole(self, index):
+        '''
+        Return the gap (in ms) between the car at index and the fastest
+        car, or None
+        '''
+        return self.get_gap_to_position(index, 1)
+
+    def get_gap_to_position(self, index, position):
+        '''
+        Return the gap (in ms) between the car at index and the car in the
+        given position (e.g. the last one going through to the next part
+        of the qualifying), negative if it's ahead, or None
+        '''
+        best_lap = self.best_laps.get(index)
+        if best_lap is None or not 0 < position <= len(self.entries):
+            return None
+        return best_lap - self.entries[position - 1][0]
+
+    def get_indexes(self):
+        '''
+        Return the cars' indexes from the fastest
+        '''
+        return [index for _, index in self.entries]
+
+    def get_position(self, index):
+        '''
+        Return the position of the car at index, or None if it has no best
+        lap
+        '''
+        rank = self._get_rank(index)
+        return rank + 1 if rank != -1 else None
+
+    def remove(self, index):
+        '''
+        Remove the car at index, return False if it wasn't there
+        '''
+        rank = self._get_rank(index)
+        if rank == -1:
+            return False
+        del self.entries[rank]
+        del self.best_laps[index]
+        return True
+
+    def update(self, index, best_lap):
+        '''
+        Set the best lap of the car at index
+        '''
+        self.remove(index)
+        self.best_laps[index] = best_lap
+        insort(self.entries, (best_lap, index))
+
+
+class History(object):
+    '''
+    Keep the time (from Session.clock, in ms) at which every car started
+    each sector of its last laps.
+    Each car gets a ring buffer of laps, with one slot per sector. The
+    number of laps kept is set so that max_cars cars use at most memory
+    bytes, the oldest laps are overwritten. See resize if more cars join.
+    '''
+    def __init__(self, sectors_count, max_cars, memory=HISTORY_MEMORY):
+        self.sectors_count = sectors_count
+        self.max_cars = max(1, max_cars)
+        self.memory_limit = memory
+        self.laps_count = self._get_laps_count()
+        self.cars_count = 0
+
+        # The lap held by each slot of the cars' ring buffers, -1 if empty:
+        # laps[i * laps_count + lap % laps_count]
+        self.laps = array('i')
+        # The sector times of these laps, -1 if unknown:
+        # times[(i * laps_count + lap % laps_count) * sectors_count + sector]
+        self.times = array('d')
+
+    @property
+    def bytes_per_lap(self):
+        return array('i').itemsize + self.sectors_count * \
+            array('d').itemsize
+
+    def _get_laps_count(self):
+        return max(2, self.memory_limit // (self.max_cars *
+                                            self.bytes_per_lap))
+
+    def _get_slot(self, index, lap):
+        '''
+        Return the slot of the car at index holding lap, or -1
+        '''
+        if index >= self.cars_count or lap < 0:
+            return -1
+        slot = index * self.laps_count + lap % self.laps_count
+        return slot if self.laps[slot] == lap else -1
+
+    def add_car(self):
+        '''
+        Add the ring buffer of the next car, return False if there is
+        already max_cars cars
+        '''
+        if self.cars_count >= self.max_cars:
+            return False
+        self.laps.extend([-1] * self.laps_count)
+        self.times.extend([-1] * (self.laps_count * self.sectors_count))
+        self.cars_count += 1
+        return True
+
+    def get_gap_trend(self, index, other, laps=5):
+        '''
+        Return how much the car at index gained on other per lap (in ms,
+        positive if it's closing in) over the last laps, from the gaps when
+        they started their last common laps, or None if unknown
+        '''
+        lap = min(self.get_last_lap(index), self.get_last_lap(other))
+        first = lap - laps
+        before = self.get_sector_time(index, first, 0)
+        other_before = self.get_sector_time(other, first, 0)
+        after = self.get_sector_time(index, lap, 0)
+        other_after = self.get_sector_time(other, lap, 0)
+        if None in (before, other_before, after, other_after):
+            return None
+        return ((before - other_before) - (after - other_after)) / laps
+
+    def get_last_lap(self, index):
+        '''
+        Return the last lap the car at index started, or -1
+        '''
+        if index >= self.cars_count:
+            return -1
+        start = index * self.laps_count
+        return max(self.laps[start:start + self.laps_count])
+
+    def get_lap_time(self, index, lap):
+        '''
+        Return the time of the car at index for lap (in ms), or None
+        '''
+        start = self.get_sector_time(index, lap, 0)
+        end = self.get_sector_time(index, lap + 1, 0)
+        if start is None or end is None:
+            return None
+        return end - start
+
+    def resize(self, max_cars):
+        '''
+        Share the memory between max_cars cars, keeping the last laps of
+        the cars already added which still fit
+        '''
+        laps_count = self.laps_count
+        laps = self.laps
+        times = self.times
+        sectors_count = self.sectors_count
+        cars_count = self.cars_count
+
+        self.max_cars = max(1, max_cars, cars_count)
+        self.laps_count = self._get_laps_count()
+        self.cars_count = 0
+        self.laps = array('i')
+        self.times = array('d')
+        for index in range(cars_count):
+            self.add_car()
+            start = index * laps_count
+            kept = sorted(lap for lap in laps[start:start + laps_count]
+                          if lap >= 0)[-self.laps_count:]
+            for lap in kept:
+                old = (start + lap % laps_count) * sectors_count
+                slot = index * self.laps_count + lap % self.laps_count
+                self.laps[slot] = lap
+                self.times[slot * sectors_count:
+                           (slot + 1) * sectors_count] = \
+                    times[old:old + sectors_count]
+
+    def get_sector_time(self, index, lap, sector):
+        '''
+        Return the time at which the car at index started sector on lap,
+        or None
+        '''
+        slot = self._get_slot(index, lap)
+        if slot == -1:
+            return None
+        time_ = self.times[slot * self.sectors_count + sector]
+        return time_ if time_ >= 0 else None
+
+    def memory(self):
+        '''
+        Return the number of bytes used by the ring buffers
+        '''
+        return len(self.laps) * self.laps.itemsize + \
+            len(self.times) * self.times.itemsize
+
+    def record(self, index, crossing, time_):
+        '''
+        Store the time at which the car at index started a sector,
+        crossing is laps * sectors_count + sector
+        '''
+        if index >= self.cars_count:
+            return
+
+        lap, sector = divmod(crossing, self.sectors_count)
+        slot = index * self.laps_count + lap % self.laps_count
+        if self.laps[slot] != lap:
+            # Overwrite the oldest lap
+            self.laps[slot] = lap
+            start = slot * self.sectors_count
+            self.times[start:start + self.sectors_count] = \
+                array('d', [-1] * self.sectors_count)
+        self.times[slot * self.sectors_count + sector] = time_
+
+
+class LapTrace(object):
+    '''
+    Record the time (in ms since the start of the lap) at which the player
+    reached points evenly spaced spline positions during the given lap,
+    interpolated between the updates of the shared memory.
+    The lap is only valid if it's followed from the start line to the
+    finish line without jumping (e.g. back to the pits).
+    '''
+    def __init__(self, lap, points=REFERENCE_LAP_POINTS):
+        self.lap = lap
+        self.points = points
+        self.times = array('i', [0] * points)
+        self.next = 1  # Next point to record
+        self.position = 0  # Last position (in points) and its time
+        self.time = 0
+        self.valid = True
+
+    def add(self, spline_pos, time_):
+        '''
+        Record the points passed since the last update, the car is at
+        spline_pos time_ ms after the start of the lap
+        '''
+        position = spline_pos * self.points
+        distance = position - self.position
+        if not 0 < distance < self.points / 2:
+            # Not moving, or still before the line (the lap count and the
+            # spline position don't change in the same update)
+            if -self.points / 2 < distance < \
+                    -MAX_FRAME_DISTANCE * self.points:
+                self.valid = False
+            return
+        if distance > MAX_FRAME_DISTANCE * self.points:
+            self.valid = False
+
+        times = self.times
+        start_time = self.time
+        start = self.position
+        point = self.next
+        last = min(int(position), self.points - 1)
+        while point <= last:
+            times[point] = int(start_time + (time_ - start_time) *
+                               (point - start) / distance)
+            point += 1
+
+        self.next = point
+        self.position = position
+        self.time = time_
+
+    def finish(self, lap_time):
+        '''
+        Return the lap as a pitboardDLL.laps.ReferenceLap if it's valid,
+        or None
+        '''
+        remaining = self.points - self.position
+        if not self.valid or lap_time <= 0 or \
+                remaining > MAX_FRAME_DISTANCE * self.points:
+            return None
+
+        # Record the points between the last update and the finish line
+        self.add(1, lap_time)
+        return laps.ReferenceLap(lap_time, self.times)
+
+
+def track_car_path(static, root, extension):
+    '''
+    Return the path of the file under root for the track, layout and car in
+    the static page of the shared memory, or None if they're unknown
+    '''
+    if not static.track or not static.carModel:
+        return None
+
+    def clean(name):
+        return re.sub(r'[^\w.-]', '_', name) or '_'
+
+    return os.path.join(root, clean(static.track),
+                        clean(static.trackConfiguration or 'default'),
+                        clean(static.carModel) + extension)
+
+
+def _scale_image(image, width, height):
+    '''
+    Scale an image (width, height, rows) to the given size with the
+    nearest pixel, as a list of rows. The GIL is released after each row,
+    so that the main thread doesn't wait for the whole image.
+    '''
+    source_width, source_height, source_rows = image
+    columns = [x * source_width // width * 4 for x in range(width)]
+    rows = []
+    for y in range(height):
+        source = source_rows[y * source_height // height]
+        row = bytearray(width * 4)
+        for x, sx in enumerate(columns):
+            row[x * 4:x * 4 + 4] = source[sx:sx + 4]
+        rows.append(row)
+        time.sleep(0)
+    return rows
+
+
+def _blend_rows(rows, layer, colour=(1, 1, 1)):
+    '''
+    Blend the rows of an RGBA layer, tinted with colour, over rows. The GIL
+    is released after each row, see _scale_image.
+    '''
+    r, g, b = colour
+    for row, layer_row in zip(rows, layer):
+        for i in range(0, len(row), 4):
+            alpha = layer_row[i + 3]
+            if not alpha:
+                continue
+            src_a = alpha / 255.0
+            dst_a = row[i + 3] / 255.0 * (1 - src_a)
+            out_a = src_a + dst_a
+            row[i] = int((layer_row[i] * r * src_a + row[i] * dst_a) /
+                         out_a + 0.5)
+            row[i + 1] = int((layer_row[i + 1] * g * src_a +
+                              row[i + 1] * dst_a) / out_a + 0.5)
+            row[i + 2] = int((layer_row[i + 2] * b * src_a +
+                              row[i + 2] * dst_a) / out_a + 0.5)
+            row[i + 3] = int(out_a * 255 + 0.5)
+        time.sleep(0)
+
+
+class RowCompositor(object):
+    '''
+    Compose whole rows of cards (background, coloured character and
+    reflection) into single textures, so that a row is rendered with one
+    quad instead of three per card.
+
+    The images are composed by a background thread and saved in
+    ROWS_CACHE_PATH, named after a hash of the row's characters and colours,
+    the least recently used ones are removed when the cache grows over
+    ROWS_CACHE_SIZE bytes. The images are composed at the cards' size, the
+    quad is scaled like the cards' were.
+
+    Textures can only be loaded from the main thread (see poll) and can't be
+    freed, so only the rows which are shown again are composed (e.g. names,
+    not lap times), see request, and once ROWS_TEXTURES_MEMORY bytes of
+    textures are loaded the new rows are rendered card by card.
+    '''
+    VERSION = 1  # Change to ignore the images already in the cache
+
+    def __init__(self, background_path, reflection_path,
+                 path=ROWS_CACHE_PATH, cache_size=ROWS_CACHE_SIZE,
+                 textures_memory=ROWS_TEXTURES_MEMORY,
+                 compose_after=ROWS_COMPOSE_AFTER):
+        self.background_path = background_path
+        self.reflection_path = reflection_path
+        self.path = path
+        self.cache_size = cache_size
+        self.textures_memory = textures_memory
+        self.compose_after = compose_after
+
+        # Main thread
+        self.textures = {}  # {key: texture}, kept as they can't be freed
+        self.memory = 0
+        self.requests = OrderedDict()  # {key: times shown}, LRU first
+        self.pending = set()
+        self.failed = set()
+
+        # Shared with the worker thread
+        self.jobs = queue.Queue()
+        self.done = deque()  # (key, path, width, height), path None on error
+        self.thread = None
+
+        # Worker thread
+        self.images = {}  # {path: decoded image}
+        self.tiles = {}  # {(path, width, height, colour): rows}
+        self.index = None  # {filename: size} from least to most recent
+
+    def _compose(self, key, cards):
+        '''
+        Compose the row image if it isn't in the cache already, return its
+        path, width and height
+        '''
+        if self.index is None:
+            self._scan_cache()
+
+        filename = '%s.png' % key
+        path = os.path.join(self.path, filename)
+        width = sum(card[1] for card in cards)
+        height = max(card[2] for card in cards)
+
+        if filename in self.index and os.path.exists(path):
+            # Mark the image as recently used
+            os.utime(path, None)
+            self.index[filename] = self.index.pop(filename)
+            return path, width, height
+
+        rows = [bytearray() for _ in range(height)]
+        for card_path, card_width, card_height, colour in cards:
+            tile = self._get_tile(card_path, card_width, card_height, colour)
+            for y, row in enumerate(rows):
+                if y < card_height:
+                    row += tile[y]
+                else:
+                    row += bytearray(card_width * 4)
+
+        tmp_path = path + '.tmp'
+        png.write(tmp_path, width, height, rows)
+        os.replace(tmp_path, path)
+
+        self.index[filename] = os.path.getsize(path)
+        self._evict()
+        return path, width, height
+
+    def _evict(self):
+        '''
+        Remove the least recently used images until the cache fits in
+        cache_size
+        '''
+        total = sum(self.index.values())
+        while total > self.cache_size and len(self.index) > 1:
+            filename, size = self.index.popitem(last=False)
+            total -= size
+            try:
+                os.remove(os.path.join(self.path, filename))
+            except OSError:
+                pass
+
+    def _get_image(self, path):
+        try:
+            return self.images[path]
+        except KeyError:
+            image = self.images[path] = png.read(path)
+            return image
+
+    def _get_key(self, cards, colours):
+        data = repr((self.VERSION, [(card.path, card.width, card.height,
+                                     colour)
+                                    for card, colour in zip(cards, colours)]))
+        return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+    def _get_tile(self, path, width, height, colour):
+        '''
+        Return the rows of a card: background, character tinted with colour
+        and reflection
+        '''
+        tile_key = (path, width, height, colour)
+        try:
+            return self.tiles[tile_key]
+        except KeyError:
+            pass
+
+        if path:
+            rows = _scale_image(self._get_image(self.background_path),
+                                width, height)
+            _blend_rows(rows, _scale_image(self._get_image(path),
+                                           width, height), colour)
+            _blend_rows(rows, _scale_image(
+                self._get_image(self.reflection_path), width, height))
+        else:
+            # Whitespace, nothing is rendered
+            rows = [bytearray(width * 4) for _ in range(height)]
+
+        self.tiles[tile_key] = rows
+        return rows
+
+    def _run(self):
+        while True:
+            key, cards = self.jobs.get()
+            try:
+                path, width, height = self._compose(key, cards)
+            except Exception:  # pylint: disable=W0703
+                path, width, height = None, 0, 0
+            self.done.append((key, path, width, height))
+
+    def _scan_cache(self):
+        '''
+        Build the index of the images in the cache, from the least to the
+        most recently used
+        '''
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+
+        files = []
+        for filename in os.listdir(self.path):
+            path = os.path.join(self.path, filename)
+            if filename.endswith('.png'):
+                stat = os.stat(path)
+                files.append((stat.st_mtime, filename, stat.st_size))
+            elif filename.endswith('.tmp'):
+                # Left by an interrupted write
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+        self.index = OrderedDict(
+            (filename, size) for _, filename, size in sorted(files))
+
+    def get_texture(self, key):
+        '''
+        Return the texture for the given key, or None if it isn't loaded
+        '''
+        return self.textures.get(key)
+
+    def poll(self):
+        '''
+        Load the textures of the rows composed since the last call, return
+        True if any was loaded. Must be called from the main thread.
+        '''
+        loaded = False
+        while self.done:
+            key, path, width, height = self.done.popleft()
+            self.pending.discard(key)
+
+            texture = ac.newTexture(path) if path else -1
+            if texture < 0:
+                self.failed.add(key)
+                continue
+
+            self.textures[key] = texture
+            self.memory += width * height * 4
+            loaded = True
+
+        return loaded
+
+    def request(self, cards, colours):
+        '''
+        Return the key of the row's image and its texture, or None if it
+        isn't available (yet). The image is composed in the background once
+        the row has been requested compose_after times, rows which are only
+        shown once (e.g. lap times) keep being rendered card by card, as are
+        the new rows once textures_memory is used.
+        '''
+        key = self._get_key(cards, colours)
+        texture = self.textures.get(key)
+
+        if texture is None and key not in self.pending and \
+                key not in self.failed and \
+                self.memory < self.textures_memory:
+            shown = self.requests.pop(key, 0) + 1
+            if shown < self.compose_after:
+                self.requests[key] = shown
+                if len(self.requests) > ROWS_REQUESTS_MEMORY:
+                    self.requests.popitem(last=False)
+                return key, None
+
+            self.pending.add(key)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run)
+                self.thread.daemon = True
+                self.thread.start()
+            self.jobs.put((key, [(card.path, card.width, card.height, colour)
+                                 for card, colour in zip(cards, colours)]))
+
+        return key, texture
+
+
+def scan_glyphs(path=TEX_PATH):
+    '''
+    Return the images of the characters found in path as
+    {char: [filename, width, height]}, the width and height are taken from
+    the filenames (e.g. A_33_50.png)
+    '''
+    names = dict((name, char) for char, name in CHARS_MAPS.items())
+    chars = string.ascii_uppercase + string.digits + ''.join(names.values())
+
+    glyphs = {}
+    for filename in sorted(os.listdir(path)):
+        r = re.match(r'([^_]+)_(\d+)_(\d+)\.png$', filename)
+        if not r:
+            continue
+        name, width, height = r.groups()
+        char = names.get(name, name)
+        if char in chars and char not in glyphs:
+            glyphs[char] = [filename, int(width), int(height)]
+
+    return glyphs
+
+
+def load_glyphs(path=GLYPHS_PATH):
+    '''
+    Return the glyphs from the manifest created by tools/glyphs.py when
+    releasing the app, or scan the images if there is no manifest
+    '''
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return scan_glyphs()
 
 
 class Card(object):
     '''
     Represent a single letter or symbol on the board
     '''
-    def __init__(self, char, path, background, reflection):
+    def __init__(self, char, path, width, height, background, reflection):
         self.char = char
+        self.path = path
+        self.width = width
+        self.height = height
         self.background = background
         self.reflection = reflection
-        if path:
-            self.texture = ac.newTexture(path)
-        else:
-            self.texture = None
-
-        # Get width/height from filename
-        r = re.match(r'[^_]+_(\d+)_(\d+).png', os.path.basename(path))
-        if r:
-            width, height = [int(x) for x in r.groups()]
-        elif char == ' ':  # Special case for whitespace
-            width = 15
-            height = 50
-        else:
-            width = 40
-            height = 50
+        self.texture = None  # Loaded on first use, see load
 
-        self.width = width
-        self.height = height
+    def load(self):
+        '''
+        Load the card's texture if it isn't loaded yet
+        '''
+        if self.texture is None and self.path:
+            self.texture = ac.newTexture(self.path)
 
-    def render(self, x, y, opacity, scale, colour):
+    def draw(self, draw_list, x, y, opacity, scale, colour):
+        '''
+        Add the quads of the card to the draw list
+        '''
         if self.texture:
             width = self.width * scale
             height = self.height * scale
-            ac.glColor4f(1, 1, 1, opacity)
-            ac.glQuadTextured(x, y, width, height, self.background)
-
-            # Render text with colour
-            args = colour + (opacity, )
-            ac.glColor4f(*args)
-            ac.glQuadTextured(x, y, width, height, self.texture)
-
-            ac.glColor4f(1, 1, 1, opacity)
-            ac.glQuadTextured(x, y, width, height, self.reflection)
+            white = (1, 1, 1, opacity)
+            draw_list.extend((
+                (self.background, white, x, y, width, height),
+                # Render text with colour
+                (self.texture, colour + (opacity, ), x, y, width, height),
+                (self.reflection, white, x, y, width, height),
+            ))
 
 
 class Text(object):
@@ -358,21 +2059,30 @@ class Text(object):
 
 class Row(object):
     '''
-    Represents a row of cards
+    Represents a row of cards, rendered as a single texture once the
+    compositor (if any) has composed it
     '''
-    def __init__(self, x, y, max_width, library):
+    def __init__(self, x, y, max_width, library, compositor=None):
         self.x = x  # Relative coordinates of top-left corner of the row
         self.y = y
         self.max_width = max_width
         self.library = library
+        self.compositor = compositor
         self.width = 0
+        self.height = 0
         self.cards = []
         self.colours = []
+        self.key = None
+        self.texture = None
+        self.text = None  # (text, colour) of the cards
 
     def _clear(self):
         self.cards = []
         self.colours = []
         self.width = 0
+        self.height = 0
+        self.key = None
+        self.texture = None
 
     def _add_card(self, card, colour):
         '''
@@ -385,21 +2095,37 @@ class Row(object):
         self.cards.append(card)
         self.colours.append(COLOURS[colour])
         self.width += card.width
+        self.height = max(self.height, card.height)
         return True
 
-    def render(self, opacity, scale, board_x, board_y):
+    def draw(self, draw_list, opacity, scale, board_x, board_y):
         '''
-        Render the given row, x and y correspond to the absolute
-        coordinate of the top left corner of the board
+        Add the quads of the row to the draw list, x and y correspond to
+        the absolute coordinate of the top left corner of the board
         '''
         x = board_x + self.x * scale
         y = board_y + self.y * scale
+
+        if self.texture is not None:
+            draw_list.append((self.texture, (1, 1, 1, opacity), x, y,
+                              self.width * scale, self.height * scale))
+            return
+
         for card, colour in zip(self.cards, self.colours):
-            card.render(x, y, opacity, scale, colour)
+            card.draw(draw_list, x, y, opacity, scale, colour)
             x += card.width * scale
 
-    def set_text(self, text):
+    def set_text(self, text, composite=True):
+        '''
+        Lay out the cards of the text, return False if the row already
+        shows it. Live rows, whose text changes while they're shown, aren't
+        composited.
+        '''
+        if (text.text, text.colour) == self.text:
+            return False
+
         self._clear()
+        self.text = (text.text, text.colour)
         for letter, colour in zip(text.text.upper(), text.colour):
             try:
                 card = self.library[letter]
@@ -408,18 +2134,42 @@ class Row(object):
 
             if not self._add_card(card, colour):
                 break
+            card.load()
+
+        if self.compositor and self.cards and composite:
+            self.key, self.texture = self.compositor.request(self.cards,
+                                                             self.colours)
+
+        return True
+
+    def update_texture(self):
+        '''
+        Look for the row's texture if it wasn't available yet, return True
+        if it was found
+        '''
+        if self.texture is None and self.key is not None:
+            self.texture = self.compositor.get_texture(self.key)
+            return self.texture is not None
+        return False
 
 
 class Board(object):
     '''
     Represents the board itself
     '''
-    def __init__(self, library):
+    def __init__(self, library, compositor=None):
         self.display = False
 
+        # List of quads to render as (texture, colour, x, y, width, height),
+        # it's built again when the text, opacity, scale or orientation
+        # changes (draw_key)
+        self.draw_list = []
+        self.draw_key = None
+
         # Create 6 rows starting from 80 pixels, every 60 pixels
         self.rows = [
-            Row(x=10, y=y, max_width=240, library=library)
+            Row(x=10, y=y, max_width=240, library=library,
+                compositor=compositor)
             for y in range(80, 440, 60)
         ]
 
@@ -445,53 +2195,105 @@ class Board(object):
         else:
             self.logo = None
 
-    def render(self, opacity, scale, orientation_x, orientation_y):
+    def _build_draw_list(self, opacity, scale, orientation_x, orientation_y):
         '''
-        Render the board frame and logo, call render
-        for all the Rows
+        Build the list of quads for the board frame, logo and all the Rows
         '''
-        if self.display:
-            width = 260 * scale
-            height = 440 * scale
+        width = 260 * scale
+        height = 440 * scale
 
-            if orientation_x == 'L':
-                x = 0
-            else:
-                x = APP_SIZE_X - width
+        if orientation_x == 'L':
+            x = 0
+        else:
+            x = APP_SIZE_X - width
 
-            if orientation_y == 'U':
-                y = APP_SIZE_Y
-            else:
-                y = -height
+        if orientation_y == 'U':
+            y = APP_SIZE_Y
+        else:
+            y = -height
 
-            ac.glColor4f(1, 1, 1, opacity)
-            ac.glQuadTextured(x, y, width, height, self.texture)
-
-            if self.logo:
-                ac.glColor4f(1, 1, 1, opacity)
-                ac.glQuadTextured(
-                    x + 10 * scale,
-                    y + 10 * scale,
-                    240 * scale,
-                    60 * scale,
-                    self.logo
-                )
-
-            for row in self.rows:
-                row.render(opacity, scale, x, y)
-
-    def update_rows(self, text):
+        white = (1, 1, 1, opacity)
+        draw_list = [(self.texture, white, x, y, width, height)]
+
+        if self.logo:
+            draw_list.append((
+                self.logo,
+                white,
+                x + 10 * scale,
+                y + 10 * scale,
+                240 * scale,
+                60 * scale,
+            ))
+
+        for row in self.rows:
+            row.draw(draw_list, opacity, scale, x, y)
+
+        self.draw_list = draw_list
+
+    def render(self, opacity, scale, orientation_x, orientation_y):
+        '''
+        Render the quads of the draw list, the colour is only set when it
+        differs from the previous quad's
+        '''
+        if not self.display:
+            return
+
+        key = (opacity, scale, orientation_x, orientation_y)
+        if key != self.draw_key:
+            self._build_draw_list(opacity, scale, orientation_x,
+                                  orientation_y)
+            self.draw_key = key
+
+        gl_color = ac.glColor4f
+        gl_quad = ac.glQuadTextured
+        current = None
+        for texture, colour, x, y, width, height in self.draw_list:
+            if colour != current:
+                gl_color(*colour)
+                current = colour
+            gl_quad(x, y, width, height, texture)
+
+    def update_rows(self, text, live=()):
+        '''
+        Set the text of the rows, only the rows whose text changed are laid
+        out again. The rows in live are then updated with update_row.
+        '''
+        changed = False
         row = 0
 
         for line in text:
-            self.rows[row].set_text(line)
+            changed |= self.rows[row].set_text(line, row not in live)
             row += 1
             if row >= len(self.rows):
                 break
 
         # Clear the rest of the board
         for row in range(row, len(self.rows)):
-            self.rows[row].set_text(Text())
+            changed |= self.rows[row].set_text(Text())
+
+        if changed:
+            # The draw list must be built again
+            self.draw_key = None
+
+    def update_row(self, row, text):
+        '''
+        Set the text of a single live row
+        '''
+        if self.rows[row].set_text(text, composite=False):
+            # The draw list must be built again
+            self.draw_key = None
+
+    def update_textures(self, compositor):
+        '''
+        Load the rows' textures composed in the background
+        '''
+        if not compositor.poll():
+            return
+
+        for row in self.rows:
+            if row.update_texture():
+                # The draw list must be built again
+                self.draw_key = None
 
 
 class UI(object):
@@ -501,14 +2303,16 @@ class UI(object):
     def __init__(self, session_):
         self.display_title = False
         self.display_title_start = None
+        self.compositor = None
         self.library = self._create_library()
-        self.board = Board(self.library)
+        self.board = Board(self.library, self.compositor)
         self.session = session_
         self.prefs_button = None
         self.prefs_texture = ac.newTexture(os.path.join(TEX_PATH, 'prefs.png'))
-        self.prefs_controls = {}
+        self.prefs_controls = {}  # Created when first shown
         self.prefs_visible = False
         self.widget = None
+        self.widget_title = None  # Whether the title is shown, None if unknown
         self.x = 0  # Absolute x on screen
         self.y = 0  # Absolute y on screen
 
@@ -532,20 +2336,29 @@ class UI(object):
         chars = string.ascii_uppercase + string.digits + \
             ''.join(CHARS_MAPS.keys()) + ' '
 
-        bg = ac.newTexture(os.path.join(TEX_PATH, 'card_bg.png'))
-        reflect = ac.newTexture(os.path.join(TEX_PATH, 'card_reflect.png'))
+        bg_path = os.path.join(TEX_PATH, 'card_bg.png')
+        reflect_path = os.path.join(TEX_PATH, 'card_reflect.png')
+        bg = ac.newTexture(bg_path)
+        reflect = ac.newTexture(reflect_path)
 
+        if COMPOSITE_ROWS:
+            self.compositor = RowCompositor(bg_path, reflect_path)
+
+        # The textures of the cards are only loaded when they're used
+        glyphs = load_glyphs()
         for char in chars:
             try:
-                pchar = CHARS_MAPS[char]
+                filename, width, height = glyphs[char]
+                path = os.path.join(TEX_PATH, filename)
             except KeyError:
-                pchar = char
+                path = ''
+                height = 50
+                if char == ' ':  # Special case for whitespace
+                    width = 15
+                else:
+                    width = 40
 
-            path = glob.glob(
-                os.path.join(TEX_PATH, '%s_*_*.png' % pchar)
-            )
-            path = path[0] if path else ''
-            library[char] = Card(char, path, bg, reflect)
+            library[char] = Card(char, path, width, height, bg, reflect)
 
         return library
 
@@ -621,7 +2434,7 @@ class UI(object):
         ac.addOnCheckBoxChanged(check,
                                 callback_use_surname_checkbox_changed)
         ac.setVisible(check, 0)
-        self.prefs_controls['short_name_checkbox'] = check
+        self.prefs_controls['use_surname_checkbox'] = check
 
         check = ac.addCheckBox(self.widget, 'Detailed delta')
         ac.setPosition(check, 270, 360)
@@ -658,8 +2471,6 @@ class UI(object):
         ac.drawBorder(self.prefs_button, 0)
         ac.addOnClickedListener(self.prefs_button, callback_prefs_button)
 
-        self._create_prefs_controls()
-
         ac.addRenderCallback(self.widget, render_callback)
         ac.addOnAppActivatedListener(self.widget, activated_callback)
 
@@ -683,7 +2494,8 @@ class UI(object):
         Called at start or when the app is (re)activated
         '''
         self.display_title = True
-        self.display_title_start = datetime.now()
+        self.display_title_start = self.session.clock.now
+        self.widget_title = None
 
     def orientation_button_click(self):
         if self.session.orientation_x == 'L':
@@ -703,6 +2515,8 @@ class UI(object):
         self.prefs_visible = not self.prefs_visible
 
         if self.prefs_visible:
+            if not self.prefs_controls:
+                self._create_prefs_controls()
             self._set_orientation_label()
 
             # Increase side of the widget, make controls visible
@@ -722,21 +2536,33 @@ class UI(object):
         '''
         Called with on acUpdate, to update the title, opacity, etc.
         '''
+        if self.compositor:
+            self.board.update_textures(self.compositor)
+
+        self.session.prefs_writer.log()
+        self.session.lap_writer.log()
+        self.session.best_laps_writer.log()
+
         # Check if the widget has moved
         x, y = ac.getPosition(self.widget)
         if x != self.x or y != self.y:
             self.activated()
             self.x, self.y = x, y
 
-        if self.display_title or self.prefs_visible:
+        if self.display_title and not self.prefs_visible:
+            display_time = self.session.clock.now - self.display_title_start
+            if display_time > TITLE_TIMEOUT * 1000:
+                self.display_title = False
+
+        # Only update the widget when the title is shown or hidden
+        title = self.display_title or self.prefs_visible
+        if title == self.widget_title:
+            return
+        self.widget_title = title
+
+        if title:
             ac.setBackgroundOpacity(self.widget, 0.3)
             ac.setTitle(self.widget, 'pitboard')
-
-            if not self.prefs_visible:
-                display_time = (datetime.now() -
-                                self.display_title_start).total_seconds()
-                if display_time > TITLE_TIMEOUT:
-                    self.display_title = False
         else:
             ac.setBackgroundOpacity(self.widget, 0)
             ac.setTitle(self.widget, '')
@@ -751,11 +2577,293 @@ class UI(object):
             ac.glQuadTextured(7, 7, 16, 16, self.prefs_texture)
 
 
+class PrefsWriter(object):
+    '''
+    Save the preferences to a JSON file from a background thread, once they
+    haven't changed for delay seconds. They are written to a temporary file
+    which then replaces the previous one, so that it's never left half
+    written.
+    The function used to open the file can be given, e.g. to simulate a
+    slow disk.
+    '''
+    def __init__(self, path=PREFS_PATH, delay=PREFS_SAVE_DELAY, opener=open):
+        self.path = path
+        self.delay = delay
+        self.opener = opener
+        self.condition = threading.Condition()
+        self.data = None  # Latest preferences, None once written
+        self.deadline = 0
+        self.writing = False
+        self.messages = deque()  # Messages for the console, see log
+        self.thread = None
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while self.data is None:
+                    self.condition.wait()
+
+                # Wait until the preferences stop changing
+                remaining = self.deadline - time.monotonic()
+                while remaining > 0:
+                    self.condition.wait(remaining)
+                    remaining = self.deadline - time.monotonic()
+
+                data = self.data
+                self.data = None
+                self.writing = True
+
+            try:
+                self._write(data)
+                if data:
+                    self.messages.append('Wrote %s' % self._describe(data))
+            except Exception as e:  # pylint: disable=W0703
+                self.messages.append('Can\'t write %s: %s' %
+                                     (self._describe(data), e))
+            finally:
+                with self.condition:
+                    self.writing = False
+                    self.condition.notify_all()
+
+    def _describe(self, data):
+        return 'prefs to "%s": %s' % (self.path, data)
+
+    def _write(self, data):
+        tmp_path = self.path + '.tmp'
+        with self.opener(tmp_path, 'w') as f:
+            f.write(json.dumps(data))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def flush(self, timeout=None):
+        '''
+        Write the pending preferences now, return False if they still
+        weren't written after timeout seconds
+        '''
+        with self.condition:
+            self.deadline = 0
+            self.condition.notify_all()
+            return self.condition.wait_for(
+                lambda: self.data is None and not self.writing, timeout)
+
+    def log(self):
+        '''
+        Show the messages from the background thread in the console
+        '''
+        while self.messages:
+            ac.console(self.messages.popleft())
+
+    def save(self, data):
+        '''
+        Save the preferences (a dict) after delay seconds, unless they
+        change again in the meantime
+        '''
+        with self.condition:
+            self.data = data
+            self.deadline = time.monotonic() + self.delay
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run)
+                self.thread.daemon = True
+                self.thread.start()
+            self.condition.notify_all()
+
+
+class LapWriter(PrefsWriter):
+    '''
+    Save the reference laps from a background thread, the data is
+    (path, pitboardDLL.laps.ReferenceLap), see PrefsWriter
+    '''
+    def __init__(self, delay=0, opener=open):
+        PrefsWriter.__init__(self, None, delay, opener)
+
+    def _describe(self, data):
+        return 'reference lap to "%s"' % data[0]
+
+    def _write(self, data):
+        path, lap = data
+        laps.write_lap(path, lap.lap_time, lap.times, self.opener)
+
+
+class BestLapsWriter(PrefsWriter):
+    '''
+    Add the new best laps of the BestLapCaches to their files, and look up
+    the drivers the caches need in them, from a background thread, see
+    PrefsWriter. The data is {path: {driver name: best lap}}, the laps
+    waiting to be written are merged with the new ones. The laps looked up
+    are put in loaded as (path, {driver name: best lap}).
+    Reading from the same thread as the writes means a file is never open
+    when it's replaced, which would fail on Windows.
+    '''
+    def __init__(self, delay=BEST_LAPS_SAVE_DELAY, opener=open):
+        PrefsWriter.__init__(self, None, delay, opener)
+        self.loads = []  # (path, names) to look up, guarded by condition
+        self.loaded = deque()
+
+    def _describe(self, data):
+        return 'best laps to %s' % ', '.join('"%s"' % path for path in data)
+
+    def _write(self, data):
+        with self.condition:
+            loads = self.loads
+            self.loads = []
+        for path, names in loads:
+            try:
+                if os.path.exists(path):
+                    laps = bestlaps.lookup(path, names)
+                else:
+                    laps = dict.fromkeys(names, 0)
+            except Exception as e:  # pylint: disable=W0703
+                self.messages.append('Can\'t read best laps "%s": %s' %
+                                     (path, e))
+                laps = dict.fromkeys(names, 0)
+            self.loaded.append((path, laps))
+
+        for path, best_laps in data.items():
+            bestlaps.merge(path, best_laps, self.opener)
+
+    def load(self, path, names):
+        '''
+        Look up the drivers' best laps saved in path as soon as possible,
+        they are put in loaded
+        '''
+        with self.condition:
+            self.loads.append((path, names))
+            PrefsWriter.save(self, self.data or {})
+            self.deadline = 0
+
+    def save(self, data):
+        '''
+        Save the new best laps of a cache, data is (path, best laps)
+        '''
+        path, best_laps = data
+        with self.condition:
+            pending = dict(self.data or {})
+            laps = dict(pending.get(path, {}))
+            laps.update(best_laps)
+            pending[path] = laps
+            PrefsWriter.save(self, pending)
+
+
+class BestLapCache(object):
+    '''
+    The best laps (in ms) of the drivers seen in past sessions on a track,
+    layout and car, so that they're known before the drivers set a lap.
+    Each combination has its own file indexed by driver (see
+    pitboardDLL.bestlaps and track_car_path), where the writer looks the
+    drivers up when they appear (see want, load and poll), and which it
+    updates in the background when a driver improves.
+    '''
+    def __init__(self, path, writer):
+        self.path = path  # None if the track or car is unknown
+        self.writer = writer
+        self.wanted = []  # Drivers to look up, see load
+        self.asked = set()
+        self.saved = {}  # The laps looked up
+        self.best_laps = {}  # The laps set in this session
+
+    def get(self, name):
+        '''
+        Return the driver's best lap, or 0 if unknown or not looked up yet
+        '''
+        lap_time = self.best_laps.get(name, 0)
+        saved = self.saved.get(name, 0)
+        if saved and not 0 < lap_time <= saved:
+            lap_time = saved
+        return lap_time
+
+    def want(self, name):
+        '''
+        Have the driver's lap looked up, see load
+        '''
+        if self.path is not None and name not in self.asked:
+            self.asked.add(name)
+            self.wanted.append(name)
+
+    def load(self):
+        '''
+        Ask the writer to look up the drivers wanted since the last call
+        '''
+        if self.wanted:
+            self.writer.load(self.path, self.wanted)
+            self.wanted = []
+
+    def poll(self):
+        '''
+        Take the laps looked up by the writer, return True if there were
+        any since the last call
+        '''
+        read = False
+        while self.writer.loaded:
+            path, laps = self.writer.loaded.popleft()
+            if path == self.path:
+                self.saved.update(laps)
+                read = True
+        return read
+
+    def update(self, name, lap_time):
+        '''
+        Save the driver's lap if it's the best one, the writer keeps the
+        best of the lap and the saved one if it wasn't looked up yet
+        '''
+        best = self.get(name)
+        if self.path is None or best and best <= lap_time:
+            return
+        self.best_laps[name] = lap_time
+        self.writer.save((self.path, {name: lap_time}))
+
+
+def load_prefs(path, defaults):
+    '''
+    Return the preferences saved in path, the values which are missing or
+    have the wrong type are taken from defaults (a dict). If the file can't
+    be read all the defaults are returned.
+    '''
+    prefs = dict(defaults)
+
+    if not os.path.exists(path):
+        return prefs
+
+    try:
+        with open(path) as f:
+            data = json.load(f)
+        if not isinstance(data, dict):
+            raise ValueError('not a JSON object')
+    except Exception as e:  # pylint: disable=W0703
+        ac.console('pitboard: Ignoring damaged prefs "%s": %s' % (path, e))
+        return prefs
+
+    numbers = (int, float)
+    for key, value in data.items():
+        if key not in defaults:
+            ac.console('Unknown key "%s" in "%s"' % (key, path))
+            continue
+
+        default = defaults[key]
+        if isinstance(default, bool) or isinstance(value, bool):
+            valid = isinstance(value, bool) and isinstance(default, bool)
+        elif isinstance(default, numbers):
+            valid = isinstance(value, numbers)
+        else:
+            valid = isinstance(value, type(default))
+
+        if valid:
+            prefs[key] = value
+        else:
+            ac.console('Invalid value %r for "%s" in "%s"' %
+                       (value, key, path))
+
+    return prefs
+
+
 class Session(object):
     '''
     Represent a racing sessions.
+    The clock used for timing can be given, it defaults to a Clock
+    following the game time.
     '''
-    def __init__(self):
+    def __init__(self, clock=None):
+        self.clock = clock or Clock()
         self.ui = None
         self.detailed_delta = DETAILED_DELTA
         self.display_timeout = DISPLAY_TIMEOUT
@@ -765,6 +2873,8 @@ class Session(object):
         self.opacity = OPACITY
         self.orientation_x = ORIENTATION_X
         self.orientation_y = ORIENTATION_Y
+        self.sectors_count = SECTORS_COUNT
+        self.sectors_length = SECTORS_LENGTH
         self.short_names = SHORT_NAMES
         self.smallsize_scale = SMALLSIZE_SCALE
         self.use_surname = USE_SURNAME
@@ -774,20 +2884,50 @@ class Session(object):
         self.fuel_consumption = -1
         self.initial_fuel = -1
         self.refuel_lap = -1
-        self.travelled_laps = 0
-
-        self._reset()
 
+        # Copies of the shared memory pages, see update_data and _reset
+        self.graphics = None
+        self.physics = None
+        self.static = None
+
+        # Last graphics packet processed
+        self.packet_id = -1
+
+        # Events of the cars, dispatched once per frame after the cars'
+        # update, see _update_cars
+        self.events = EventQueue()
+        if DEBUG:
+            for event_type in EVENTS:
+                self.events.subscribe(event_type, self._log_event)
+        for event_type in (LAP_COMPLETED, PIT_ENTRY, PIT_EXIT):
+            self.events.subscribe(event_type, self._update_fuel)
+        self.events.subscribe(LAP_COMPLETED, self._update_board_due)
+        self.events.subscribe(BEST_LAP_SET, self._save_best_lap)
+        self.events.subscribe(DRIVER_CHANGED, self._load_best_lap)
+
+        self.prefs_writer = PrefsWriter()
         self._load_prefs()
 
+        # The player's best lap on the current track and car, the current
+        # lap, and the last lap until we know if it's the best, see
+        # _update_reference
+        self.lap_writer = LapWriter()
+        self.best_laps_writer = BestLapsWriter()
+        self.reference = None
+        self.reference_path = None
+        self.trace = None
+        self.finished_lap = None
+
+        self._reset()
+
     def _check_session(self):
         '''
         Set the current session ID and the number of laps,
         Reset if a new session has started
         '''
-        session_status = info.graphics.status
-        session_type = info.graphics.session
-        current_lap = info.graphics.completedLaps
+        session_status = self.graphics.status
+        session_type = self.graphics.session
+        current_lap = self.graphics.completedLaps
 
         if session_type != self.session_type and self.session_type != -1 or \
                 current_lap < self.current_lap:
@@ -798,70 +2938,141 @@ class Session(object):
         self.session_status = session_status
         self.session_type = session_type
 
-    def _get_split(self, car1, car2):
+    def _get_sectors_count(self):
         '''
-        Returns the last available split time between two cars as a string
+        Return the number of sectors to use for the current track, based on
+        the track's length if sectors_length is set
         '''
-        if not car1 or not car2:
-            return None
-
-        # Get the last common sector (i.e: the last sector from the car behind)
-        if car1.position > car2.position:
-            last_sector = car1.last_sector
-        else:
-            last_sector = car2.last_sector
+        track_length = self.static.trackSPlineLength
+        if self.sectors_length > 0 and track_length > 0:
+            return max(1, int(round(track_length / self.sectors_length)))
+        return max(1, int(self.sectors_count))
 
-        if last_sector is None:
-            # Car hasn't done a sector yet
-            return None
+    def _get_splits(self, player):
+        '''
+        Returns a dict of cars' indexes and their last available split time
+        (in ms) with the player, from their gaps to the leader
+        '''
+        get_gap = self.cars.get_gap
+        return dict((index, get_gap(player.index, index))
+                    for index in range(1, len(self.cars)))
 
-        s1 = car1.sectors[last_sector]
-        s2 = car2.sectors[last_sector]
+    def _load_reference(self):
+        '''
+        Map the player's reference lap for the current track and car, if
+        it's not the one already loaded
+        '''
+        path = track_car_path(self.static, REFERENCE_LAPS_PATH, '.lap')
+        if path == self.reference_path:
+            return
 
-        if not (s1 and s2):
-            return None
+        if self.reference:
+            self.reference.close()
+        self.reference = None
+        self.reference_path = path
+        if path is None or not os.path.exists(path):
+            return
 
-        return s1 - s2
+        try:
+            self.reference = laps.open_lap(path)
+            debug('Loaded reference lap: %s', path)
+        except Exception as e:  # pylint: disable=W0703
+            ac.console('pitboard: Ignoring reference lap "%s": %s' %
+                       (path, e))
 
-    def _get_splits(self, player):
+    def _load_best_lap(self, event):
         '''
-        Returns a dict of cars and their split time with the player
+        Set the best lap of a driver who just appeared if it was already
+        looked up, or have it looked up, see _load_best_laps. They only
+        order the cars without a lap outside of races.
         '''
-        splits = {}
-        for car in self.cars[1:]:
-            splits[car] = self._get_split(player, car)
+        name = event.value
+        if isinstance(name, str):
+            self.cars.set_cached_best(event.car, self.best_laps.get(name))
+            if self.session_type != RACE:
+                self.best_laps.want(name)
 
-        return splits
+    def _load_best_laps(self):
+        '''
+        Have the drivers who appeared looked up in the background, and set
+        their best laps once they're found
+        '''
+        best_laps = self.best_laps
+        best_laps.load()
+        if best_laps.poll():
+            set_cached_best = self.cars.set_cached_best
+            for index, name in enumerate(self.cars.names):
+                if isinstance(name, str):
+                    set_cached_best(index, best_laps.get(name))
+
+    def _log_event(self, event):
+        debug('Event: %s', event)
+
+    def _update_board_due(self, event):
+        if event.car == 0:
+            # The board's text is computed again when it's next shown
+            self.board_due = True
+
+    def _save_best_lap(self, event):
+        name = self.cars.names[event.car]
+        if isinstance(name, str):
+            self.best_laps.update(name, event.value)
 
     def _load_prefs(self):
         '''
         Loads preferences from JSON file
         '''
-        if not os.path.exists(PREFS_PATH):
-            return
-
-        try:
-            f = open(PREFS_PATH)
-        except Exception as e:
-            ac.console('Pitboard: Error opining "%s": %s' % (PREFS_PATH, e))
-            return
-
-        data = f.readline()
-        data = json.loads(data)
-        for key, value in data.items():
-            if key in PREFS_KEYS:
-                setattr(self, key, value)
-            else:
-                ac.console('Unknown key "%s" in "%s"' % (key, PREFS_PATH))
+        defaults = dict((key, getattr(self, key)) for key in PREFS_KEYS)
+        for key, value in load_prefs(PREFS_PATH, defaults).items():
+            setattr(self, key, value)
 
     def _reset(self):
+        self.static = info.static_snapshot(refresh=True)
         self.current_lap = 0
+        self.board_due = True
         self.last_best_lap = None
         self.laps = 0
-        self.cars = []
+        self.events.clear()
+        sectors_count = self._get_sectors_count()
+        # Number of cars the static page was read for, see _refresh_static
+        self.static_count = ac.getCarsCount()
+        self.history = History(sectors_count, max(self.static.numCars,
+                                                  self.static_count))
+        self.cars = CarTable(self, sectors_count, self.events, self.history)
         self.scale = self.fullsize_scale
         self.session_type = -1
         self.last_splits = {}
+        self.trace = None
+        self.finished_lap = None
+        self._load_reference()
+        self.best_laps = BestLapCache(
+            track_car_path(self.static, BEST_LAPS_PATH, '.laps'),
+            self.best_laps_writer)
+
+    def _refresh_static(self, cars_count):
+        '''
+        Read the static page again when cars join, it can still be empty
+        when the session starts (e.g. in replays). The session is reset if
+        the track or car changed, otherwise the history is resized for the
+        number of cars. It's only read once per number of cars, as empty
+        slots keep the cars count above the number of cars.
+        '''
+        self.static_count = cars_count
+        static = info.static_snapshot(refresh=True)
+        if (static.track, static.trackConfiguration, static.carModel,
+                static.trackSPlineLength) != \
+                (self.static.track, self.static.trackConfiguration,
+                 self.static.carModel, self.static.trackSPlineLength):
+            debug('Static page changed: %s, %s', static.track,
+                  static.carModel)
+            self._reset()
+            return
+
+        self.static = static
+        max_cars = max(static.numCars, cars_count)
+        if max_cars > self.history.max_cars:
+            debug('History resized for %d cars', max_cars)
+            self.history.resize(max_cars)
 
     def _set_scale(self, current_time):
         '''
@@ -882,42 +3093,59 @@ class Session(object):
         '''
         Return True if the board should be displayed
         '''
-        is_in_pit = info.graphics.isInPit
-        pit_limiter_on = info.physics.pitLimiterOn
+        is_in_pit = self.graphics.isInPit
+        pit_limiter_on = self.physics.pitLimiterOn
 
         return current_time > 0.2 and self.current_lap > 0 and \
             (current_time < self.display_timeout or
                 self.display_timeout == -1) and \
             (not pit_limiter_on or not is_in_pit)
 
-    def _update_board_quali(self):
+    def _get_reference_text(self):
+        '''
+        Return the board's row with the player's delta to the reference lap
+        at the current position, see get_reference_delta
+        '''
+        delta = self.get_reference_delta()
+        if delta is None:
+            return Text()
+        return Text('PB ' + ms_to_str(delta, precise=False),
+                    'g' if delta < 0 else 'r')
+
+    def _get_text_quali(self, car):
         '''
-        Displays:
-         Position
+        Return the board's text in practice and qualifying:
+         Position - Time left in session
          Name of car ahead in the standings (if any)
+         Gap to the car ahead (if any)
          Last laptime
+         Delta of the last laptime to the best
+         Live delta to the reference lap (if any)
         '''
         text = []
 
-        current_time = info.graphics.iCurrentTime / 1000  # convert to seconds
-        last_lap = info.graphics.iLastTime
-        time_left = info.graphics.sessionTimeLeft
-
-        car = self.get_player_car()
-        if not car:
-            return text
+        last_lap = self.graphics.iLastTime
+        time_left = self.graphics.sessionTimeLeft
 
         ahead = self.get_car_by_position(car.position - 1)
 
-        text.append(Text('P%d' % car.position))
+        if time_left > 0:
+            text.append(Text('P%d - %s' % (
+                car.position, time_to_str(time_left, show_ms=False))))
+        else:
+            text.append(Text('P%d' % car.position))
 
         # Display name of car ahead in the standings (if any)
         if ahead:
             text.append(Text(ahead.get_name()))
-            if car.best_lap and ahead.best_lap:
-                text.append(
-                    Text(ms_to_str((car.best_lap - ahead.best_lap)), 'r')
-                )
+            gap = self.cars.leaderboard.get_gap_to_ahead(car.index)
+            best_lap = car.best_lap or car.cached_best
+            ahead_best_lap = ahead.best_lap or ahead.cached_best
+            if gap is not None:
+                text.append(Text(ms_to_str(gap), 'r'))
+            elif best_lap and ahead_best_lap:
+                # Estimated from the best laps of past sessions
+                text.append(Text(ms_to_str(best_lap - ahead_best_lap), 'w'))
             else:
                 text.append(Text())
         else:
@@ -936,32 +3164,16 @@ class Session(object):
                 text.append(Text(ms_to_str(delta), colour))
             else:
                 text.append(Text())
+        else:
+            text += [Text(), Text()]
 
-        # Display time left in session
-        if time_left > 0:
-            text.append(Text('LEFT ' + time_to_str(time_left, show_ms=False)))
-
-        if self._should_display_board_quali(current_time):
-            self._set_scale(current_time)
-
-            # Update the text when the board is displayed
-            if self.ui.board.display is False:
-                self.ui.board.update_rows(text)
-                self.last_best_lap = car.best_lap
-                debug('Updating board (quali), lap: %d' % self.current_lap)
-
-                for car in self.cars:
-                    debug(car)
-                debug('Text:\n %s \n' % '\n'.join([str(t) for t in text]))
+        text.append(self._get_reference_text())
 
-            self.ui.board.display = True
-        else:
-            self.ui.board.display = False
-            self.scale = self.fullsize_scale
+        return text
 
-    def _update_board_race(self):
+    def _get_text_race(self, car, splits):
         '''
-        Displays:
+        Return the board's text in a race:
          Position - Laps left
          Name of car ahead (if any)
          Split to car ahead (if any)
@@ -971,43 +3183,35 @@ class Session(object):
         '''
         text = []
 
-        current_time = info.graphics.iCurrentTime / 1000  # convert to seconds
-        last_lap = info.graphics.iLastTime
+        last_lap = self.graphics.iLastTime
         session_time_left = 0
-        if info.graphics.sessionTimeLeft > 0:
-            session_time_left = info.graphics.sessionTimeLeft
-
-        car = self.get_player_car()
-        if not car:
-            return text
+        if self.graphics.sessionTimeLeft > 0:
+            session_time_left = self.graphics.sessionTimeLeft
 
         ahead = self.get_car_by_position(car.position - 1)
         behind = self.get_car_by_position(car.position + 1)
 
-        if info.static.isTimedRace:
+        if self.static.isTimedRace:
             text.append(Text('P%d - R%s' %
                 (car.position, time_to_str(session_time_left, show_ms=False))))
         else:
             text.append(Text('P%d - L%d' %
                 (car.position, self.laps - self.current_lap)))
 
-        # Get current split times
-        splits = self._get_splits(car)
-
         # Display split to car ahead (if any)
-        if ahead and splits[ahead]:
+        if ahead and splits[ahead.index]:
             text.append(Text(ahead.get_name()))
-            line = split_to_str(splits[ahead], arrows=True)
+            line = split_to_str(splits[ahead.index], arrows=True)
             colour = len(line) * 'r'
 
-            if ahead in self.last_splits:
-                delta = round_delta(splits[ahead]) - \
-                        round_delta(self.last_splits[ahead])
+            if ahead.index in self.last_splits:
+                delta = round_delta(splits[ahead.index]) - \
+                        round_delta(self.last_splits[ahead.index])
 
                 if self.detailed_delta:
                     line += ' (%s)' % split_to_str(delta)
 
-                if delta.total_seconds() > 0:
+                if delta > 0:
                     colour = 'r' + colour[1:] + 'r'
                 else:
                     colour = 'g' + colour[1:] + 'g'
@@ -1021,20 +3225,20 @@ class Session(object):
             text.append(Text(time_to_str(last_lap)))
 
         # Display split to car behind (if any)
-        if behind and splits[behind]:
-            line = split_to_str(splits[behind], arrows=True)
+        if behind and splits[behind.index]:
+            line = split_to_str(splits[behind.index], arrows=True)
             colour = len(line) * 'g'
 
-            if behind in self.last_splits:
-                delta = round_delta(splits[behind]) - \
-                        round_delta(self.last_splits[behind])
+            if behind.index in self.last_splits:
+                delta = round_delta(splits[behind.index]) - \
+                        round_delta(self.last_splits[behind.index])
 
                 if self.detailed_delta:
                     line += ' (%s)' % split_to_str(delta)
                 else:
                     line += ' (%s)' % split_to_str(delta)[0]
 
-                if delta.total_seconds() > 0:
+                if delta > 0:
                     colour = 'r' + colour[1:] + 'r'
                 else:
                     colour = 'g' + colour[1:] + 'g'
@@ -1044,6 +3248,56 @@ class Session(object):
         else:
             text += [Text(), Text()]
 
+        return text
+
+    def _update_board_quali(self):
+        '''
+        Show or hide the board in practice and qualifying, its text is only
+        computed when it's shown, see _get_text_quali
+        '''
+        current_time = self.graphics.iCurrentTime / 1000  # convert to seconds
+
+        car = self.get_player_car()
+        if not car:
+            return
+
+        if self._should_display_board_quali(current_time):
+            self._set_scale(current_time)
+
+            # Update the text when the board is first displayed after the
+            # player completed a lap
+            if self.board_due:
+                self.board_due = False
+                text = self._get_text_quali(car)
+                self.ui.board.update_rows(
+                    text, (QUALI_REFERENCE_ROW, ) if self.reference else ())
+                self.last_best_lap = car.best_lap
+                debug('Updating board (quali), lap: %d', self.current_lap)
+                debug('Delta to best lap: %s', self.get_reference_delta())
+                debug(debug_cars, self.cars)
+                debug(debug_text, text)
+            elif self.reference:
+                # The delta to the reference lap is live, its row is only
+                # laid out again when the shown value changes
+                self.ui.board.update_row(QUALI_REFERENCE_ROW,
+                                         self._get_reference_text())
+
+            self.ui.board.display = True
+        else:
+            self.ui.board.display = False
+            self.scale = self.fullsize_scale
+
+    def _update_board_race(self):
+        '''
+        Show or hide the board in a race, its text is only computed when
+        it's shown, see _get_text_race
+        '''
+        current_time = self.graphics.iCurrentTime / 1000  # convert to seconds
+
+        car = self.get_player_car()
+        if not car:
+            return
+
         if current_time > 0.2 and self.current_lap > 0 and \
                 (current_time < self.display_timeout or
                  self.display_timeout == -1):
@@ -1054,14 +3308,19 @@ class Session(object):
             self._set_scale(current_time)
 
             # Update the text and save the current splits when the board is
-            # displayed
-            if self.ui.board.display is False:
-                debug('Updating board (race), lap: %d' % self.current_lap)
-                debug('Last splits:\n%s' % debug_splits(self.last_splits))
-                debug('Current splits:\n%s' % debug_splits(splits))
-                for car in self.cars:
-                    debug(car)
-                debug('Text:\n %s \n' % '\n'.join([str(t) for t in text]))
+            # first displayed after the player completed a lap
+            if self.board_due:
+                self.board_due = False
+                splits = self._get_splits(car)
+                text = self._get_text_race(car, splits)
+                names = tuple(self.cars.names)
+                debug('Updating board (race), lap: %d', self.current_lap)
+                debug('Last splits:')
+                debug(debug_splits, names, self.last_splits)
+                debug('Current splits:')
+                debug(debug_splits, names, splits)
+                debug(debug_cars, self.cars)
+                debug(debug_text, text)
                 self.ui.board.update_rows(text)
                 self.last_splits = splits
 
@@ -1071,27 +3330,34 @@ class Session(object):
             self.scale = self.fullsize_scale
 
     def _update_cars(self):
-        for i in range(ac.getCarsCount()):
-            try:
-                car = self.cars[i]
-            except IndexError:
-                name = ac.getDriverName(i)
-                if name == -1:
-                    # No such car
-                    break
-                car = Car(i, name, self, self.session_type)
-                self.cars.append(car)
+        count = ac.getCarsCount()
+        if count > len(self.cars) and count != self.static_count:
+            self._refresh_static(count)
+
+        cars = self.cars
+        for i in range(len(cars), count):
+            name = ac.getDriverName(i)
+            if name == -1:
+                # No such car
+                break
+            cars.add(name)
 
-            car.update_data(self.session_type)
+        cars.update(count, self.session_type, self.clock.now,
+                    1 if self.graphics.isInPit else 0)
 
         if self.session_type == RACE:
             # Update the cars' race position, we could use
             # ac.getCarRealTimeLeaderboardPosition but it's not always reliable:
-            for i, car in enumerate(sorted(
-                    self.cars, key=lambda car: (-car.lap, -car.spline_pos))):
-                car.position = i + 1
+            cars.sort_race_order(self.clock.now)
+
+        self.events.dispatch()
+        self._load_best_laps()
 
-    def _update_fuel(self):
+    def _update_fuel(self, event):
+        '''
+        Follow the player's fuel consumption since the last refuel, when the
+        player completes a lap or goes through the pits
+        '''
         # TODO:
         # Add variables to session
         #  - initial_fuel = -1
@@ -1120,56 +3386,89 @@ class Session(object):
         # TODO: handle race/session restarts
         # TODO: How to handle when refueling with less fuel? (fuel change with car stopped?)
 
-        current_fuel = info.physics.fuel
-
-        # In hotlap mode the car starts before the pit straight but still
-        # appears a lap 0, so we can compare the expected distance with the
-        # actual distance
-        if self.current_lap == 0 and info.graphics.distanceTraveled < (info.static.trackSPlineLength * info.graphics.normalizedCarPosition):
+        if event.car != 0:
             return
 
-        # When the car is in the pits we don't update the fuel info:
-        if info.graphics.isInPit:
-            return
+        current_fuel = self.physics.fuel
+        if event.type == LAP_COMPLETED:
+            lap = event.value
+        else:
+            lap = self.cars.lap[0] + self.cars.spline_pos[0]
 
         if current_fuel > 0 and current_fuel > self.current_fuel:
-            # Player has refueled
+            # Player has refueled, or it's the first lap of the session
             self.initial_fuel = current_fuel
-            self.refuel_lap = self.current_lap + info.graphics.normalizedCarPosition
+            self.refuel_lap = lap
             # TODO: Should we reset fuel consumption as well?
 
-            debug('Refuel: %s' % current_fuel)
-            debug('Refuel lap: %f' % self.refuel_lap)
-            debug('Consumption: %f' % self.fuel_consumption)
+            debug('Refuel: %s', current_fuel)
+            debug('Refuel lap: %f', self.refuel_lap)
+            debug('Consumption: %f', self.fuel_consumption)
 
         self.current_fuel = current_fuel
 
-        # If we've travelled at least one lap, update the average fuel consumption
-        travelled_laps = self.current_lap + info.graphics.normalizedCarPosition - self.refuel_lap
+        travelled_laps = lap - self.refuel_lap
+        if travelled_laps > 1:
+            self.fuel_consumption = (self.initial_fuel - current_fuel) / travelled_laps
+        debug('Consumption: %f %f', self.fuel_consumption, lap)
+
+    def _update_reference(self):
+        '''
+        Record the player's current lap, and keep the last one as the
+        reference lap (saved for the next sessions) once it's known to be
+        the best lap of the session and it beats the reference
+        '''
+        graphics = self.graphics
+        lap = graphics.completedLaps
+        trace = self.trace
+
+        if trace is None or lap != trace.lap:
+            if trace is not None and lap == trace.lap + 1:
+                self.finished_lap = trace.finish(graphics.iLastTime)
+            else:
+                self.finished_lap = None
+            trace = self.trace = LapTrace(lap)
+        trace.add(graphics.normalizedCarPosition, graphics.iCurrentTime)
 
-        if travelled_laps < self.travelled_laps or \
-                (travelled_laps - self.travelled_laps > 0.5):
-            # When crossing the start finish line sometimes the spline gets
-            # at a different time than  the current_lap which results in
-            # incorrect data
-            # We skip it if it looks like we've moved more than 1/2 a lap
-            # since last update
+        finished = self.finished_lap
+        if finished is None:
             return
-        else:
-            self.travelled_laps = travelled_laps
 
-        if travelled_laps > 1:
-            self.fuel_consumption = (self.initial_fuel - current_fuel) / travelled_laps
-        debug('Consumption: %f %d %f' % (self.fuel_consumption, self.current_lap, info.graphics.normalizedCarPosition))
+        # The best lap from ac only counts valid laps
+        car = self.get_player_car()
+        if not car or car.best_lap != finished.lap_time:
+            return
+
+        self.finished_lap = None
+        if self.reference_path is None or self.reference and \
+                self.reference.lap_time <= finished.lap_time:
+            return
+
+        debug('New reference lap: %d', finished.lap_time)
+        if self.reference:
+            # The file can't be replaced while it's mapped
+            self.reference.close()
+        self.reference = finished
+        self.lap_writer.save((self.reference_path, finished))
+
+    def get_reference_delta(self):
+        '''
+        Return the time (in ms) the player is behind the reference lap at
+        the current position (negative if ahead), or None if unknown
+        '''
+        trace = self.trace
+        if not self.reference or not trace or not trace.valid or \
+                not trace.position:
+            return None
+        return self.graphics.iCurrentTime - \
+            self.reference.get_time(self.graphics.normalizedCarPosition)
 
     def get_car_by_position(self, position):
         '''
         Returns the car in the given position, or None
         '''
-        for car in self.cars:
-            if car.position == position:
-                return car
-        return None
+        index = self.cars.get_index_by_position(position)
+        return self.cars[index] if index != -1 else None
 
     def get_player_car(self):
         '''
@@ -1189,20 +3488,11 @@ class Session(object):
 
     def save_prefs(self):
         '''
-        Save preferences to JSON file
+        Save preferences to JSON file, in the background after a short
+        delay, see PrefsWriter
         '''
-        try:
-            f = open(PREFS_PATH, 'w')
-        except Exception as e:
-            ac.console('Can\'t open file "%s" for writing: %s' %
-                       (PREFS_PATH, e))
-            return
-
         data = dict((key, getattr(self, key)) for key in PREFS_KEYS)
-
-        f.write(json.dumps(data))
-        f.close()
-        ac.console('Wrote prefs to file: %s' % data)
+        self.prefs_writer.save(data)
 
     def update_board(self):
         if self.session_status == REPLAY:
@@ -1213,39 +3503,109 @@ class Session(object):
         elif self.session_type in (PRACTICE, QUALIFY, HOTLAP):
             self._update_board_quali()
 
-    def update_data(self):
+    def update_data(self, delta_t=None):
+        '''
+        Update the session's data, delta_t is the time in seconds since
+        the last update.
+        Returns False if there is nothing new to show, i.e. the sim hasn't
+        updated the shared memory since the last call (the game renders
+        faster than the sim updates, or is paused), or the session is
+        paused or off.
+        '''
+        self.clock.tick(delta_t)
+
+        if info.graphics.packetId == self.packet_id:
+            return False
+
+        # Work on a consistent copy of the shared memory for this frame
+        self.graphics, self.physics = info.snapshot()
+        self.packet_id = self.graphics.packetId
+
         self._check_session()
+        if self.session_status in (OFF, PAUSE):
+            return False
+
         self._update_cars()
-        self._update_fuel()
+        if self.session_status == LIVE:
+            self._update_reference()
 
         if self.session_type == RACE:
-            self.laps = info.graphics.numberOfLaps
+            self.laps = self.graphics.numberOfLaps
+
+        return True
 
 
 def acMain(ac_version):
-    global session  # pylint: disable=W0603
+    global session, profiler, recorder  # pylint: disable=W0603
+
+    if PROFILE:
+        profiler = Profiler()
+        profiler.install()
 
     # Create session object
     session = Session()
 
+    if RECORD:
+        if not os.path.exists(RECORDINGS_PATH):
+            os.makedirs(RECORDINGS_PATH)
+        path = os.path.join(RECORDINGS_PATH, '%s.pbr' %
+                            datetime.now().strftime('%Y%m%d-%H%M%S'))
+        recorder = Recorder(path)
+        ac.console('Pitboard: recording to %s' % path)
+
     # Initialise UI:
     ui = UI(session)
     session.ui = ui
 
+    if profiler:
+        profiler.create_overlay(ui.widget)
+
     return "pitboard"
 
 
+def log_exception():
+    '''
+    Log the current exception, and the debug messages which preceded it
+    '''
+    exc_type, exc_value, exc_traceback = sys.exc_info()
+    ac.console('pitboard Error (logged to file)')
+    ac.log(repr(traceback.format_exception(exc_type, exc_value, exc_traceback)))
+
+    messages = debug_log.dump()
+    if messages:
+        ac.log('Pitboard: debug messages before the error:\n%s' % messages)
+
+
 def acUpdate(deltaT):
     global session
 
     try:
-        session.update_data()
-        session.update_board()
+        if recorder:
+            recorder.record_frame(deltaT)
+
+        if session.update_data(deltaT):
+            session.update_board()
         session.ui.update_ui()
+
+        if profiler:
+            profiler.update()
     except:  # pylint: disable=W0702
-        exc_type, exc_value, exc_traceback = sys.exc_info()
-        ac.console('pitboard Error (logged to file)')
-        ac.log(repr(traceback.format_exception(exc_type, exc_value, exc_traceback)))
+        log_exception()
+
+
+def acShutdown():
+    global recorder  # pylint: disable=W0603
+
+    if session:
+        session.prefs_writer.flush(PREFS_SHUTDOWN_TIMEOUT)
+        session.lap_writer.flush(PREFS_SHUTDOWN_TIMEOUT)
+        session.best_laps_writer.flush(PREFS_SHUTDOWN_TIMEOUT)
+
+    debug_log.flush()
+
+    if recorder:
+        recorder.close()
+        recorder = None
 
 
 def render_callback(deltaT):
@@ -1254,9 +3614,7 @@ def render_callback(deltaT):
     try:
         session.render()
     except:  # pylint: disable=W0702
-        exc_type, exc_value, exc_traceback = sys.exc_info()
-        ac.console('pitboard Error (logged to file)')
-        ac.log(repr(traceback.format_exception(exc_type, exc_value, exc_traceback)))
+        log_exception()
 
 
 def activated_callback(value):
@@ -1269,54 +3627,63 @@ def callback_detailed_delta_checkbox_changed(name, state):
     global session
 
     session.detailed_delta = state is 1
+    session.save_prefs()
 
 
 def callback_display_timeout_spinner_changed(value):
     global session
 
     session.display_timeout = value
+    session.save_prefs()
 
 
 def callback_fullsize_scale_spinner_changed(value):
     global session
 
     session.fullsize_scale = value / 100.0
+    session.save_prefs()
 
 
 def callback_fullsize_timeout_spinner_changed(value):
     global session
 
     session.fullsize_timeout = value
+    session.save_prefs()
 
 
 def callback_short_name_checkbox_changed(name, state):
     global session
 
     session.short_names = state is 1
+    session.save_prefs()
 
 
 def callback_smallsize_scale_spinner_changed(value):
     global session
 
     session.smallsize_scale = value / 100.0
+    session.save_prefs()
 
 
 def callback_use_surname_checkbox_changed(name, state):
     global session
 
     session.use_surname = state is 1
+    session.save_prefs()
 
 
 def callback_opacity_spinner_changed(value):
     global session
 
     session.opacity = value / 100.0
+    session.save_prefs()
 
 
 def callback_orientation_button(x, y):
     global session
 
     session.ui.orientation_button_click()
+    session.save_prefs()
 
 
 def callback_prefs_button(x, y):
@@ -0,0 +1,107 @@
+"""
+Best laps of drivers, in a file of fixed size records sorted by the hash of
+the driver's name, so that a driver's lap is found with a binary search
+reading a few records, whatever the number of drivers in the file.
+
+The file holds, little endian:
+
+    magic       4 bytes, b'PBBL'
+    version     uint16
+    reserved    uint16
+    count       uint32
+    records     count * (name hash uint64, lap time int32 in ms)
+
+The hash is the first 8 bytes of the MD5 of the name in UTF-8.
+"""
+import hashlib
+import os
+import struct
+
+MAGIC = b'PBBL'
+VERSION = 1
+HEADER = struct.Struct('<4sHHI')
+RECORD = struct.Struct('<Qi')
+
+
+class BestLapsError(Exception):
+    pass
+
+
+def name_hash(name):
+    digest = hashlib.md5(name.encode('utf-8')).digest()
+    return struct.unpack('<Q', digest[:8])[0]
+
+
+def _read_header(f, path):
+    data = f.read(HEADER.size)
+    if len(data) < HEADER.size:
+        raise BestLapsError('%s is too short' % path)
+    magic, version, _, count = HEADER.unpack(data)
+    if magic != MAGIC or version != VERSION:
+        raise BestLapsError('%s is not a best laps file' % path)
+    if os.fstat(f.fileno()).st_size != HEADER.size + count * RECORD.size:
+        raise BestLapsError('%s is damaged' % path)
+    return count
+
+
+def lookup(path, names):
+    """
+    Return the best laps of the drivers saved in path, {name: best lap},
+    0 for the drivers who aren't in the file
+    """
+    laps = {}
+    with open(path, 'rb') as f:
+        count = _read_header(f, path)
+        for name in names:
+            key = name_hash(name)
+            laps[name] = 0
+            low = 0
+            high = count
+            while low < high:
+                middle = (low + high) // 2
+                f.seek(HEADER.size + middle * RECORD.size)
+                record_key, lap_time = RECORD.unpack(f.read(RECORD.size))
+                if record_key < key:
+                    low = middle + 1
+                elif record_key > key:
+                    high = middle
+                else:
+                    laps[name] = lap_time
+                    break
+    return laps
+
+
+def read(path):
+    """
+    Return all the laps saved in path, {name hash: best lap}
+    """
+    with open(path, 'rb') as f:
+        count = _read_header(f, path)
+        data = f.read(count * RECORD.size)
+    return dict(RECORD.unpack_from(data, i * RECORD.size)
+                for i in range(count))
+
+
+def merge(path, best_laps, opener=open):
+    """
+    Add the laps in best_laps ({name: best lap}) to the ones saved in path,
+    keeping the best of each driver. The file is written next to path and
+    then replaces it, so that it's never left half written.
+    """
+    laps = read(path) if os.path.exists(path) else {}
+    for name, lap_time in best_laps.items():
+        key = name_hash(name)
+        if not 0 < laps.get(key, 0) <= lap_time:
+            laps[key] = lap_time
+
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    tmp_path = path + '.tmp'
+    with opener(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, 0, len(laps)))
+        f.write(b''.join(RECORD.pack(key, laps[key]) for key in sorted(laps)))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
@@ -0,0 +1,120 @@
+"""
+Reference laps stored in fixed-layout binary files, which are memory-mapped
+and read in place, without parsing nor copying them.
+
+A lap is the time since the start of the lap at evenly spaced spline
+positions: the time at position i / points is times[i]. The file holds,
+little endian:
+
+    magic       4 bytes, b'PBRL'
+    version     uint16
+    points      uint16
+    lap time    int32, in ms
+    times       points * int32, in ms
+"""
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+MAGIC = b'PBRL'
+VERSION = 1
+HEADER = struct.Struct('<4sHHi')
+
+
+class LapError(Exception):
+    pass
+
+
+class ReferenceLap(object):
+    """
+    A lap's times, either in memory (e.g. a lap which was just driven) or
+    mapped from a file, see open_lap
+    """
+    def __init__(self, lap_time, times, mapping=None):
+        self.lap_time = lap_time
+        self.times = times  # Sequence of points int, in ms
+        self.points = len(times)
+        self.mapping = mapping
+
+    def close(self):
+        """
+        Release the file mapping, if any, the lap can't be used afterwards
+        """
+        if self.mapping is not None:
+            self.times.release()
+            self.mapping.close()
+            self.mapping = None
+        self.times = ()
+
+    def get_time(self, spline_pos):
+        """
+        Return the time (in ms) at which the lap reached spline_pos,
+        interpolated between the two nearest points
+        """
+        position = min(max(spline_pos, 0), 1) * self.points
+        index = int(position)
+        if index >= self.points:
+            return self.lap_time
+
+        before = self.times[index]
+        after = self.times[index + 1] if index + 1 < self.points \
+            else self.lap_time
+        return before + (after - before) * (position - index)
+
+
+def open_lap(path):
+    """
+    Map the lap saved in path, raise LapError if it's not a valid lap file
+    """
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < HEADER.size:
+            raise LapError('%s is too short' % path)
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    try:
+        magic, version, points, lap_time = HEADER.unpack_from(mapping)
+        if magic != MAGIC or version != VERSION:
+            raise LapError('%s is not a lap file' % path)
+        if points < 2 or size != HEADER.size + points * 4 or lap_time <= 0:
+            raise LapError('%s is damaged' % path)
+
+        view = memoryview(mapping)[HEADER.size:]
+        if sys.byteorder == 'little':
+            times = view.cast('i')
+        else:
+            times = array('i', view.tobytes())
+            times.byteswap()
+        view.release()
+    except Exception:
+        mapping.close()
+        raise
+
+    if not isinstance(times, memoryview):
+        mapping.close()
+        mapping = None
+    return ReferenceLap(lap_time, times, mapping)
+
+
+def write_lap(path, lap_time, times, opener=open):
+    """
+    Save a lap, the file is written next to path and then replaces it, so
+    that it's never left half written. It must not be mapped on Windows.
+    """
+    times = array('i', times)
+    if sys.byteorder != 'little':
+        times.byteswap()
+
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    tmp_path = path + '.tmp'
+    with opener(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(times), int(lap_time)))
+        f.write(times.tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
@@ -0,0 +1,122 @@
+"""
+Minimal PNG reader and writer for 8-bit RGBA non-interlaced images, which
+is the format of all of pitboard's textures.
+
+Images are handled as (width, height, rows) where rows is a list of
+bytearrays of width * 4 bytes (RGBA).
+"""
+import struct
+import zlib
+
+SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+class PNGError(Exception):
+    pass
+
+
+def _paeth(a, b, c):
+    p = a + b - c
+    pa = abs(p - a)
+    pb = abs(p - b)
+    pc = abs(p - c)
+    if pa <= pb and pa <= pc:
+        return a
+    elif pb <= pc:
+        return b
+    return c
+
+
+def _unfilter(data, width, height):
+    """
+    Undo the filter of each scanline
+    """
+    stride = width * 4
+    rows = []
+    previous = bytearray(stride)
+    pos = 0
+
+    for _ in range(height):
+        filter_type = data[pos]
+        row = bytearray(data[pos + 1:pos + 1 + stride])
+        pos += stride + 1
+
+        if filter_type == 1:  # Sub
+            for i in range(4, stride):
+                row[i] = (row[i] + row[i - 4]) & 0xff
+        elif filter_type == 2:  # Up
+            for i in range(stride):
+                row[i] = (row[i] + previous[i]) & 0xff
+        elif filter_type == 3:  # Average
+            for i in range(stride):
+                left = row[i - 4] if i >= 4 else 0
+                row[i] = (row[i] + ((left + previous[i]) >> 1)) & 0xff
+        elif filter_type == 4:  # Paeth
+            for i in range(stride):
+                if i >= 4:
+                    left = row[i - 4]
+                    up_left = previous[i - 4]
+                else:
+                    left = up_left = 0
+                row[i] = (row[i] + _paeth(left, previous[i], up_left)) & 0xff
+        elif filter_type != 0:
+            raise PNGError('Unknown filter type %d' % filter_type)
+
+        rows.append(row)
+        previous = row
+
+    return rows
+
+
+def read(path):
+    """
+    Read an 8-bit RGBA PNG file, return (width, height, rows)
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    if data[:8] != SIGNATURE:
+        raise PNGError('%s is not a PNG file' % path)
+
+    pos = 8
+    header = None
+    idat = []
+    while pos < len(data):
+        length, chunk_type = struct.unpack('>I4s', data[pos:pos + 8])
+        chunk = data[pos + 8:pos + 8 + length]
+        pos += length + 12
+
+        if chunk_type == b'IHDR':
+            header = struct.unpack('>IIBBBBB', chunk)
+        elif chunk_type == b'IDAT':
+            idat.append(chunk)
+        elif chunk_type == b'IEND':
+            break
+
+    if header is None:
+        raise PNGError('%s has no header' % path)
+
+    width, height, depth, colour_type, _, _, interlace = header
+    if depth != 8 or colour_type != 6 or interlace:
+        raise PNGError('%s is not an 8-bit RGBA non-interlaced PNG' % path)
+
+    return width, height, _unfilter(zlib.decompress(b''.join(idat)),
+                                    width, height)
+
+
+def _chunk(chunk_type, data):
+    return struct.pack('>I', len(data)) + chunk_type + data + \
+        struct.pack('>I', zlib.crc32(chunk_type + data) & 0xffffffff)
+
+
+def write(path, width, height, rows):
+    """
+    Write an 8-bit RGBA PNG file
+    """
+    raw = b''.join(b'\x00' + bytes(row) for row in rows)
+    with open(path, 'wb') as f:
+        f.write(SIGNATURE)
+        f.write(_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height,
+                                            8, 6, 0, 0, 0)))
+        f.write(_chunk(b'IDAT', zlib.compress(raw, 6)))
+        f.write(_chunk(b'IEND', b''))
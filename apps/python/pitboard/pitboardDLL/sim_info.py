@@ -20,6 +20,15 @@ some_app.py::
 
     print(info.graphics.tyreCompound, info.physics.rpms, info.static.playerNick)
 
+The pages are live views of the shared memory, the sim can write them
+while they are being read. snapshot() returns consistent immutable copies
+of the graphics and physics pages, and static_snapshot() a copy of the
+static page which is cached until refresh=True:
+
+    graphics, physics = info.snapshot()
+    print(graphics.completedLaps, graphics.normalizedCarPosition)
+    print(info.static_snapshot().track)
+
 
 Do whatever you want with this code!
 WBR, Rombik :)
@@ -27,6 +36,8 @@ WBR, Rombik :)
 import mmap
 import functools
 import ctypes
+import operator
+import struct
 from ctypes import c_int32, c_float, c_wchar
 
 
@@ -161,15 +172,120 @@ class SPageFileStatic(ctypes.Structure):
     ]
 
 
+# Number of times a page is read again if the sim wrote it during the copy
+SNAPSHOT_RETRIES = 3
+
+_STRUCT_FORMATS = {c_int32: 'i', c_float: 'f'}
+_WCHAR_ENCODING = 'utf-16-le' if ctypes.sizeof(c_wchar) == 2 else 'utf-32-le'
+_PACKET_ID = struct.Struct('<i')
+
+
+def _decode(value):
+    return value.decode(_WCHAR_ENCODING).split('\0', 1)[0]
+
+
+def _string_getter(index):
+    """
+    Return a getter for a string field, which is decoded on access unless it
+    was decoded when the record was created
+    """
+    def getter(record):
+        value = record[index]
+        if isinstance(value, bytes):
+            return _decode(value)
+        return value
+    return getter
+
+
+def _record_type(structure):
+    """
+    Return a tuple subclass with a read-only property for each field of the
+    ctypes structure (arrays as tuples), the struct.Struct reading the whole
+    structure in one go, and the indexes of its strings
+    """
+    fmt = '<'
+    position = 0
+    index = 0
+    properties = {'__slots__': ()}
+    strings = []
+
+    for name, ctype in structure._fields_:
+        field = getattr(structure, name)
+        fmt += 'x' * (field.offset - position)
+        position = field.offset + field.size
+
+        if issubclass(ctype, ctypes.Array) and ctype._type_ is c_wchar:
+            fmt += '%ds' % field.size
+            strings.append(index)
+            getter = _string_getter(index)
+            index += 1
+        elif issubclass(ctype, ctypes.Array):
+            fmt += '%d%s' % (ctype._length_, _STRUCT_FORMATS[ctype._type_])
+            getter = operator.itemgetter(slice(index, index + ctype._length_))
+            index += ctype._length_
+        else:
+            fmt += _STRUCT_FORMATS[ctype]
+            getter = operator.itemgetter(index)
+            index += 1
+        properties[name] = property(getter)
+
+    fmt += 'x' * (ctypes.sizeof(structure) - position)
+    record = type(structure.__name__ + 'Record', (tuple,), properties)
+    return record, struct.Struct(fmt), strings
+
+
 class SimInfo:
+    _physics_record = _record_type(SPageFilePhysics)
+    _graphics_record = _record_type(SPageFileGraphic)
+    _static_record = _record_type(SPageFileStatic)
+
     def __init__(self):
         self._acpmf_physics = mmap.mmap(0, ctypes.sizeof(SPageFilePhysics), "acpmf_physics")
         self._acpmf_graphics = mmap.mmap(0, ctypes.sizeof(SPageFileGraphic), "acpmf_graphics")
         self._acpmf_static = mmap.mmap(0, ctypes.sizeof(SPageFileStatic), "acpmf_static")
         self.physics = SPageFilePhysics.from_buffer(self._acpmf_physics)
         self.graphics = SPageFileGraphic.from_buffer(self._acpmf_graphics)
+        self._static = None
         self.static = SPageFileStatic.from_buffer(self._acpmf_static)
 
+    def _copy(self, buffer, record_type, seqlock=True, decode=False):
+        """
+        Copy the page in buffer to a record, if seqlock is True the page
+        starts with a packetId which is checked again after the copy, and the
+        copy is retried if the sim updated the page in the meantime.
+        Strings are decoded now if decode is True, on access otherwise.
+        """
+        record, reader, strings = record_type
+
+        for _ in range(SNAPSHOT_RETRIES):
+            values = reader.unpack_from(buffer)
+            if not seqlock or values[0] == _PACKET_ID.unpack_from(buffer)[0]:
+                break
+
+        if decode and strings:
+            values = list(values)
+            for i in strings:
+                values[i] = _decode(values[i])
+
+        return record(values)
+
+    def snapshot(self):
+        """
+        Return immutable copies of the graphics and physics pages
+        """
+        return (self._copy(self._acpmf_graphics, self._graphics_record),
+                self._copy(self._acpmf_physics, self._physics_record))
+
+    def static_snapshot(self, refresh=False):
+        """
+        Return an immutable copy of the static page, the copy is cached until
+        refresh is True (e.g. when a new session starts)
+        """
+        if self._static is None or refresh:
+            self._static = self._copy(self._acpmf_static, self._static_record,
+                                      seqlock=False, decode=True)
+        return self._static
+
     def close(self):
         self._acpmf_physics.close()
         self._acpmf_graphics.close()
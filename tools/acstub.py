@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# Copyright (C) 2014 - Mathias André
+
+'''
+Stand-in ac, acsys and sim_info modules to run pitboard outside of
+Assetto Corsa.
+
+Usage:
+
+    sim = Sim()
+    pitboard = load_pitboard(sim)
+    pitboard.acMain('1.0')
+    ...
+    sim.graphics.completedLaps = 1
+    sim.set_car(0, spline_pos=0.5, lap=1)
+    pitboard.acUpdate(0.016)
+'''
+
+import importlib.util
+import os
+import sys
+import types
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+APP_PATH = os.path.join(ROOT, 'apps', 'python', 'pitboard')
+
+# Functions of the ac module which only deal with the widget, they don't
+# return anything useful
+UI_FUNCTIONS = (
+    'addButton',
+    'addCheckBox',
+    'addLabel',
+    'addOnAppActivatedListener',
+    'addOnCheckBoxChanged',
+    'addOnClickedListener',
+    'addOnValueChangeListener',
+    'addRenderCallback',
+    'addSpinner',
+    'drawBorder',
+    'glColor4f',
+    'newApp',
+    'setBackgroundOpacity',
+    'setFontSize',
+    'setIconPosition',
+    'setPosition',
+    'setRange',
+    'setSize',
+    'setStep',
+    'setText',
+    'setTitle',
+    'setValue',
+    'setVisible',
+)
+
+
+class CS(object):
+    '''
+    Stand-in for acsys.CS
+    '''
+    BestLap = 1
+    LapCount = 2
+    LastLap = 3
+    LapTime = 4
+    NormalizedSplinePosition = 5
+    SpeedKMH = 6
+
+
+class Page(object):
+    '''
+    Stand-in for a shared memory page, fields are plain attributes
+    '''
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+
+class SimInfo(object):
+    '''
+    Stand-in for pitboardDLL.sim_info.SimInfo
+    '''
+    def __init__(self):
+        self.graphics = Page(
+            packetId=0,
+            status=2,
+            session=2,
+            completedLaps=0,
+            iCurrentTime=0,
+            iLastTime=0,
+            sessionTimeLeft=0.0,
+            distanceTraveled=0.0,
+            isInPit=0,
+            numberOfLaps=0,
+            replayTimeMultiplier=1.0,
+            normalizedCarPosition=0.0,
+        )
+        self.physics = Page(
+            packetId=0,
+            fuel=0.0,
+            pitLimiterOn=0,
+        )
+        self.static = Page(
+            numCars=0,
+            carModel='',
+            track='',
+            trackConfiguration='',
+            trackSPlineLength=0.0,
+            isTimedRace=0,
+        )
+        self._static = None
+
+    def snapshot(self):
+        return (Page(**self.graphics.__dict__),
+                Page(**self.physics.__dict__))
+
+    def static_snapshot(self, refresh=False):
+        if self._static is None or refresh:
+            self._static = Page(**self.static.__dict__)
+        return self._static
+
+
+class Sim(object):
+    '''
+    State of the simulated game, read by the stand-in ac module
+    '''
+    def __init__(self):
+        self.info = SimInfo()
+        self.graphics = self.info.graphics
+        self.physics = self.info.physics
+        self.static = self.info.static
+        self.cars = []
+        self.cars_count = 0
+        self.messages = []
+        self.quads = 0
+        self.textures = 0
+        self.widget_position = (0, 0)
+
+    def set_car(self, index, **fields):
+        '''
+        Set the fields (see pitboard.CAR_FIELDS) of the car at index
+        '''
+        while index >= len(self.cars):
+            self.cars.append({
+                'name': -1,
+                'spline_pos': 0.0,
+                'lap': 0,
+                'best_lap': 0,
+                'position': 0,
+                'in_pit': 0,
+            })
+        self.cars[index].update(fields)
+
+    # Stand-in ac functions
+    def getCarsCount(self):
+        return self.cars_count
+
+    def getDriverName(self, index):
+        try:
+            return self.cars[index]['name']
+        except IndexError:
+            return -1
+
+    def getCarLeaderboardPosition(self, index):
+        try:
+            return self.cars[index]['position']
+        except IndexError:
+            return -1
+
+    def getCarState(self, index, state):
+        try:
+            car = self.cars[index]
+        except IndexError:
+            return -1
+
+        if state == CS.NormalizedSplinePosition:
+            return car['spline_pos']
+        elif state == CS.LapCount:
+            return car['lap']
+        elif state == CS.BestLap:
+            return car['best_lap']
+        return 0
+
+    def isCarInPitline(self, index):
+        try:
+            return self.cars[index]['in_pit']
+        except IndexError:
+            return 0
+
+    def getPosition(self, widget):
+        return self.widget_position
+
+    def glQuadTextured(self, x, y, width, height, texture):
+        self.quads += 1
+
+    def newTexture(self, path):
+        self.textures += 1
+        return self.textures
+
+    def console(self, msg):
+        self.messages.append(msg)
+
+    def log(self, msg):
+        self.messages.append(msg)
+
+    def noop(self, *args):
+        return 0
+
+
+def install(sim):
+    '''
+    Register the stand-in ac, acsys and pitboardDLL.sim_info modules, the
+    other pitboardDLL modules are imported from the app
+    '''
+    ac = types.ModuleType('ac')
+    for name in UI_FUNCTIONS:
+        setattr(ac, name, sim.noop)
+    for name in ('getCarsCount', 'getDriverName', 'getCarLeaderboardPosition',
+                 'getCarState', 'getPosition', 'glQuadTextured',
+                 'isCarInPitline', 'newTexture', 'console', 'log'):
+        setattr(ac, name, getattr(sim, name))
+
+    acsys = types.ModuleType('acsys')
+    acsys.CS = CS
+
+    dll = types.ModuleType('pitboardDLL')
+    dll.__path__ = [os.path.join(APP_PATH, 'pitboardDLL')]
+    sim_info = types.ModuleType('pitboardDLL.sim_info')
+    sim_info.info = sim.info
+    dll.sim_info = sim_info
+
+    sys.modules.update({
+        'ac': ac,
+        'acsys': acsys,
+        'pitboardDLL': dll,
+        'pitboardDLL.sim_info': sim_info,
+    })
+
+
+def load_pitboard(sim):
+    '''
+    Install the stand-in modules and return a freshly loaded pitboard module.
+    Paths in pitboard are relative to Assetto Corsa's root, so the current
+    directory is changed to the root of the repository.
+    '''
+    install(sim)
+    os.chdir(ROOT)
+    spec = importlib.util.spec_from_file_location(
+        'pitboard', os.path.join(APP_PATH, 'pitboard.py'))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules['pitboard'] = module
+    spec.loader.exec_module(module)
+    return module
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# Copyright (C) 2014 - Mathias André
+
+'''
+Measure the cost per acUpdate of pitboard's hot path as the number of cars
+grows, using synthetic sessions from synth.py.
+
+    python tools/bench.py --cars 24,64,128 --save before.json
+    (make some changes)
+    python tools/bench.py --cars 24,64,128 --compare before.json
+
+Every target is timed in its own run of the same (seeded) session, so that
+timing one function doesn't add overhead to the others.
+'''
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import acstub  # noqa: E402
+import synth  # noqa: E402
+
+# Functions to time as (name, session type, getter), getter returns the
+# object and the attribute name of the function to wrap
+TARGETS = (
+    ('acUpdate', synth.RACE, lambda pb: (pb, 'acUpdate')),
+    ('Session._update_cars', synth.RACE, lambda pb: (pb.Session, '_update_cars')),
+    ('CarTable.update', synth.RACE, lambda pb: (pb.CarTable, 'update')),
+    ('CarTable.sort_race_order', synth.RACE,
+     lambda pb: (pb.CarTable, 'sort_race_order')),
+    ('Session._get_splits', synth.RACE, lambda pb: (pb.Session, '_get_splits')),
+    ('Session._update_board_race', synth.RACE,
+     lambda pb: (pb.Session, '_update_board_race')),
+    ('render_callback', synth.RACE, lambda pb: (pb, 'render_callback')),
+    ('acUpdate (quali)', synth.QUALIFY, lambda pb: (pb, 'acUpdate')),
+)
+
+DT = 1.0 / 60  # Time between two frames
+
+
+class Timer(object):
+    '''
+    Wrap a function to accumulate the time spent in it
+    '''
+    def __init__(self, owner, name):
+        self.total = 0.0
+        self.calls = 0
+        self.enabled = False
+        function = getattr(owner, name)
+
+        def timed(*args, **kwargs):
+            if not self.enabled:
+                return function(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.total += time.perf_counter() - start
+                self.calls += 1
+
+        setattr(owner, name, timed)
+
+
+def run(target, cars, frames, warmup, seed, render_rate=1):
+    '''
+    Return the average time in microseconds spent in target per acUpdate,
+    the game renders render_rate frames for each update of the sim
+    '''
+    name, session_type, getter = target
+
+    sim = acstub.Sim()
+    pitboard = acstub.load_pitboard(sim)
+    race = synth.Race(sim, cars=cars, session_type=session_type, laps=1000,
+                      elapsed=600, pit_every=20, seed=seed)
+    timer = Timer(*getter(pitboard))
+    pitboard.acMain('bench')
+
+    for frame in range(warmup + frames):
+        if frame == warmup:
+            timer.enabled = True
+        if frame % render_rate == 0:
+            race.step(DT * render_rate)
+        pitboard.acUpdate(DT)
+        pitboard.render_callback(DT)
+
+    errors = [msg for msg in sim.messages if 'Error' in msg]
+    if errors:
+        raise RuntimeError('%s failed: %s' % (name, errors[0]))
+
+    return timer.total / frames * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--cars', default='24,64,128',
+                        help='comma separated list of field sizes')
+    parser.add_argument('--frames', type=int, default=2000)
+    parser.add_argument('--warmup', type=int, default=3000,
+                        help='number of frames before timing starts')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--render-rate', type=int, default=1,
+                        help='number of frames rendered for each update '
+                        'of the sim (e.g. 2 for 120fps with a 60Hz sim)')
+    parser.add_argument('--save', help='save the results to a JSON file')
+    parser.add_argument('--compare', help='compare with saved results')
+    args = parser.parse_args()
+
+    sizes = [int(n) for n in args.cars.split(',')]
+    save = os.path.abspath(args.save) if args.save else None
+    previous = {}
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+
+    results = {}
+    print('%-28s' % 'us per acUpdate' +
+          ''.join('%14s' % ('%d cars' % n) for n in sizes))
+    for target in TARGETS:
+        name = target[0]
+        line = '%-28s' % name
+        for cars in sizes:
+            key = '%s/%d' % (name, cars)
+            results[key] = run(target, cars, args.frames, args.warmup,
+                               args.seed, args.render_rate)
+            cell = '%.1f' % results[key]
+            if key in previous:
+                cell += ' (%+d%%)' % round(
+                    (results[key] / previous[key] - 1) * 100)
+            line += '%14s' % cell
+        print(line)
+        sys.stdout.flush()
+
+    if save:
+        with open(save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# Copyright (C) 2014 - Mathias André
+
+'''
+Write the manifest of the characters' images (imgs/glyphs.json) which
+pitboard reads at startup instead of scanning imgs/, it's created by the
+release script.
+
+    python tools/glyphs.py
+'''
+
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import acstub  # noqa: E402
+
+
+def main():
+    pitboard = acstub.load_pitboard(acstub.Sim())
+    glyphs = pitboard.scan_glyphs()
+
+    with open(pitboard.GLYPHS_PATH, 'w') as f:
+        json.dump(glyphs, f, sort_keys=True)
+        f.write('\n')
+
+    print('%d glyphs written to %s' % (len(glyphs), pitboard.GLYPHS_PATH))
+
+
+if __name__ == '__main__':
+    main()
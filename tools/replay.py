@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# Copyright (C) 2014 - Mathias André
+
+'''
+Replay a session recorded by pitboard (RECORD = True) without Assetto Corsa.
+
+    python tools/replay.py apps/python/pitboard/recordings/<date>.pbr
+
+The frames are fed as fast as possible to Session.update_data and
+Session.update_board, use --boards to print the board every time it is
+updated (e.g. to reproduce a wrong gap).
+'''
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import acstub  # noqa: E402
+
+
+def apply_frame(sim, frame):
+    '''
+    Apply a frame returned by pitboard.read_recording to the simulated game
+    '''
+    delta_t, cars_count, graphics, physics, static, cars = frame
+
+    if cars_count is not None:
+        sim.cars_count = cars_count
+    sim.graphics.__dict__.update(graphics)
+    sim.physics.__dict__.update(physics)
+    sim.static.__dict__.update(static)
+    for index, fields in cars.items():
+        sim.set_car(index, **fields)
+
+
+def print_board(sim, text):
+    print('--- lap %d, %.1fs' % (sim.graphics.completedLaps,
+                                 sim.graphics.iCurrentTime / 1000.0))
+    for line in text:
+        print('  %s' % line)
+
+
+def replay(pitboard, sim, frames, render=False):
+    '''
+    Feed the frames to pitboard, return the total recorded time in seconds
+    '''
+    session = pitboard.session
+    recorded = 0
+
+    for frame in frames:
+        apply_frame(sim, frame)
+        recorded += frame[0]
+        if session.update_data(frame[0]):
+            session.update_board()
+        if render:
+            pitboard.render_callback(frame[0])
+
+    return recorded
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('recording')
+    parser.add_argument('--boards', action='store_true',
+                        help='print the board every time it is updated')
+    parser.add_argument('--render', action='store_true',
+                        help='call the render callback for every frame')
+    parser.add_argument('--profile', action='store_true',
+                        help='enable pitboard\'s profiler and print its '
+                        'statistics')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='number of times to replay the recording')
+    args = parser.parse_args()
+
+    recording = os.path.abspath(args.recording)
+    sim = acstub.Sim()
+    pitboard = acstub.load_pitboard(sim)
+
+    # Decode the whole recording first so that only pitboard is timed
+    frames = list(pitboard.read_recording(recording))
+
+    total_wall = 0
+    total_recorded = 0
+    for _ in range(args.repeat):
+        sim = acstub.Sim()
+        pitboard = acstub.load_pitboard(sim)
+        pitboard.PROFILE = args.profile
+        pitboard.acMain('replay')
+
+        if args.boards:
+            board = pitboard.session.ui.board
+            update_rows = board.update_rows
+
+            def logged_update_rows(text, live=(), sim=sim,
+                                   update_rows=update_rows):
+                print_board(sim, text)
+                update_rows(text, live)
+            board.update_rows = logged_update_rows
+
+        start = time.perf_counter()
+        total_recorded += replay(pitboard, sim, frames, args.render)
+        total_wall += time.perf_counter() - start
+
+    count = len(frames) * args.repeat
+    print('%d frames, %.1fs recorded, replayed in %.3fs (%.0fx real time, '
+          '%.1fus per frame)' % (
+              count, total_recorded, total_wall,
+              total_recorded / total_wall if total_wall else 0,
+              total_wall / count * 1e6 if count else 0))
+
+    if args.profile:
+        print('\n'.join(pitboard.profiler.summary()))
+
+    for msg in sim.messages:
+        if 'Error' in msg:
+            print(msg, file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
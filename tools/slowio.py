@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# Copyright (C) 2014 - Mathias André
+
+'''
+Check that a slow disk never blocks acUpdate: run a synthetic quali in
+which every file pitboard writes (prefs, reference laps, best laps) takes
+--delay seconds to open, and fail if a frame took longer than --max-frame
+milliseconds.
+
+    python tools/slowio.py --delay 0.5 --max-frame 20
+
+The files are written to a temporary directory, the frames run in real
+time (one update every --step seconds) so that the writes overlap them.
+The first --warmup frames, which load the session, aren't timed.
+'''
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import acstub  # noqa: E402
+import synth  # noqa: E402
+
+
+def slow_opener(delay):
+    '''
+    Return a function which opens files like open, delay seconds later
+    '''
+    def opener(*args, **kwargs):
+        time.sleep(delay)
+        return open(*args, **kwargs)
+    return opener
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--delay', type=float, default=0.5,
+                        help='seconds to open a file')
+    parser.add_argument('--max-frame', type=float, default=20,
+                        help='maximum time of a frame, in ms')
+    parser.add_argument('--seconds', type=float, default=10,
+                        help='duration of the run')
+    parser.add_argument('--step', type=float, default=1.0 / 60)
+    parser.add_argument('--speedup', type=float, default=30,
+                        help='simulated seconds per second, so that laps '
+                        'are completed during the run')
+    parser.add_argument('--warmup', type=int, default=60,
+                        help='number of frames before timing starts')
+    parser.add_argument('--cars', type=int, default=24)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix='pitboard-slowio-')
+    try:
+        sim = acstub.Sim()
+        pitboard = acstub.load_pitboard(sim)
+        pitboard.REFERENCE_LAPS_PATH = os.path.join(root, 'laps', '')
+        pitboard.BEST_LAPS_PATH = os.path.join(root, 'bestlaps', '')
+        race = synth.Race(sim, cars=args.cars, session_type=synth.QUALIFY,
+                          laps=1000, lap_time=90.0, seed=args.seed)
+        pitboard.acMain('slowio')
+        session = pitboard.session
+
+        opener = slow_opener(args.delay)
+        session.prefs_writer = pitboard.PrefsWriter(
+            os.path.join(root, 'prefs.json'), opener=opener)
+        session.lap_writer = pitboard.LapWriter(opener=opener)
+        session.best_laps_writer = pitboard.BestLapsWriter(delay=0,
+                                                           opener=opener)
+        session.best_laps.writer = session.best_laps_writer
+
+        worst = 0
+        frames = 0
+        end = time.perf_counter() + args.seconds
+        next_prefs = 0
+        while time.perf_counter() < end:
+            race.step(args.step * args.speedup)
+            start = time.perf_counter()
+            pitboard.acUpdate(args.step)
+            if start >= next_prefs:
+                # As if a setting was changed every second
+                session.save_prefs()
+                next_prefs = start + 1
+            if frames >= args.warmup:
+                worst = max(worst, time.perf_counter() - start)
+            frames += 1
+            time.sleep(args.step)
+
+        for writer in (session.prefs_writer, session.lap_writer,
+                       session.best_laps_writer):
+            writer.flush(args.delay * 10)
+        session.ui.update_ui()
+
+        errors = [msg for msg in sim.messages
+                  if 'Error' in msg or 'Can\'t' in msg]
+        if errors:
+            raise RuntimeError(errors[0])
+        written = [msg for msg in sim.messages if msg.startswith('Wrote')]
+        print('%d frames, %d files written, worst frame %.1f ms' % (
+            frames, len(written), worst * 1000))
+        if worst * 1000 > args.max_frame:
+            print('FAIL: a frame took more than %.1f ms' % args.max_frame)
+            return 1
+        for kind in ('prefs', 'reference lap', 'best laps'):
+            if not any(msg.startswith('Wrote ' + kind) for msg in written):
+                print('no %s written, the run is too short' % kind)
+                return 1
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# Copyright (C) 2014 - Mathias André
+
+'''
+Run pitboard through a long synthetic race and report the memory it uses
+every simulated hour, fail if it grew by more than --max-growth KB after
+the first --warmup hours (the history is allocated up front, the other
+caches fill up while warming up).
+
+    python tools/soak.py --hours 24 --cars 40
+
+The sim is updated every --step seconds (instead of every frame) to keep
+the run short, the sectors crossed in between are interpolated.
+'''
+
+import argparse
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import acstub  # noqa: E402
+import synth  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--hours', type=float, default=24)
+    parser.add_argument('--cars', type=int, default=40)
+    parser.add_argument('--step', type=float, default=1.0,
+                        help='seconds between two updates of the sim')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--warmup', type=int, default=4,
+                        help='hours before the memory must stay flat')
+    parser.add_argument('--max-growth', type=int, default=256,
+                        help='KB the memory may grow by after the warmup')
+    args = parser.parse_args()
+
+    sim = acstub.Sim()
+    pitboard = acstub.load_pitboard(sim)
+    race = synth.Race(sim, cars=args.cars, session_type=synth.RACE,
+                      laps=int(args.hours * 3600 / 90) + 10, pit_every=30,
+                      seed=args.seed)
+    pitboard.acMain('soak')
+    session = pitboard.session
+
+    tracemalloc.start()
+    steps_per_hour = int(3600 / args.step)
+    print('%6s %8s %12s %14s' % ('hour', 'laps', 'history KB',
+                                 'allocated KB'))
+
+    warm = None
+    peak = 0
+    for hour in range(1, int(args.hours) + 1):
+        for _ in range(steps_per_hour):
+            race.step(args.step)
+            pitboard.acUpdate(args.step)
+
+        errors = [msg for msg in sim.messages if 'Error' in msg]
+        if errors:
+            raise RuntimeError(errors[0])
+
+        current, _ = tracemalloc.get_traced_memory()
+        print('%6d %8d %12d %14d' % (
+            hour, session.cars.lap[0], session.history.memory() // 1024,
+            current // 1024))
+        sys.stdout.flush()
+        if hour == args.warmup:
+            warm = current
+        elif warm is not None:
+            peak = max(peak, current)
+
+    history = session.history
+    print('history: %d laps per car, %d KB of %d KB' % (
+        history.laps_count, history.memory() // 1024,
+        history.memory_limit // 1024))
+    if warm is None or not peak:
+        print('the run is shorter than the warmup')
+        return 1
+    growth = (peak - warm) // 1024
+    print('growth after %d hours: %d KB' % (args.warmup, growth))
+    if growth > args.max_growth:
+        print('FAIL: the memory grew by more than %d KB' % args.max_growth)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# Copyright (C) 2014 - Mathias André
+
+'''
+Measure the time pitboard's acMain takes and the number of textures it
+loads.
+
+    python tools/startup.py --texture-cost 2
+
+The stand-in ac.newTexture returns immediately, --texture-cost adds the
+given number of milliseconds per texture to account for Assetto Corsa
+decoding and uploading the image.
+'''
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import acstub  # noqa: E402
+
+
+def run(texture_cost):
+    '''
+    Return the time in milliseconds spent in acMain and the number of
+    textures loaded
+    '''
+    sim = acstub.Sim()
+    pitboard = acstub.load_pitboard(sim)
+
+    if texture_cost:
+        new_texture = pitboard.ac.newTexture
+
+        def slow_texture(path):
+            time.sleep(texture_cost / 1000.0)
+            return new_texture(path)
+        pitboard.ac.newTexture = slow_texture
+
+    start = time.perf_counter()
+    pitboard.acMain('startup')
+    return (time.perf_counter() - start) * 1000, sim.textures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--texture-cost', type=float, default=0,
+                        help='milliseconds added to each texture load')
+    args = parser.parse_args()
+
+    times = []
+    for _ in range(args.repeat):
+        elapsed, textures = run(args.texture_cost)
+        times.append(elapsed)
+
+    times.sort()
+    print('acMain: %.2fms median, %.2fms min, %d textures loaded' % (
+        times[len(times) // 2], times[0], textures))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# Copyright (C) 2014 - Mathias André
+
+'''
+Generate synthetic sessions with any number of cars, driving the stand-in
+ac module from acstub.
+
+Every car has its own pace (depending on its class in multiclass fields),
+lap to lap variation, pit stops, and gets lapped by faster cars. Cars can
+also roll back over the start of a sector (at half distance) or over the
+finish line, and then drive over it again, see --reverse-every.
+
+    python tools/synth.py --cars 64 --laps 10 --output race.pbr
+
+writes a recording which can be replayed with tools/replay.py.
+'''
+
+import argparse
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import acstub  # noqa: E402
+
+# Session type
+PRACTICE = 0
+QUALIFY = 1
+RACE = 2
+
+# Distances in the lap where the cars which reverse start rolling back, and
+# where they stop: at half distance, and over the finish line, which
+# doesn't change their lap count. The speed at which they roll back is
+# relative to their pace.
+REVERSALS = ((0.51, 0.49), (0.01, -0.01))
+REVERSE_SPEED = 0.1
+
+# Pace of each class relative to the fastest one, cars are spread evenly
+# across the classes
+CLASSES = (1.0, 1.07, 1.15)
+
+FIRST_NAMES = ('Juan', 'Alberto', 'Jim', 'Jackie', 'Niki', 'Ayrton',
+               'Alain', 'Nelson', 'Graham', 'Jochen', 'Emerson', 'Mario')
+LAST_NAMES = ('Fangio', 'Ascari', 'Clark', 'Stewart', 'Lauda', 'Senna',
+              'Prost', 'Piquet', 'Hill', 'Rindt', 'Fittipaldi', 'Andretti')
+
+
+class SynthCar(object):
+    '''
+    A simulated car, progress is the distance travelled in laps
+    '''
+    def __init__(self, index, name, pace, progress, pit_every, rand,
+                 reverse_every=0):
+        self.index = index
+        self.name = name
+        self.pace = pace  # Average laptime in seconds
+        self.progress = progress
+        self.pit_every = pit_every
+        self.reverse_every = reverse_every
+        self.reverse_end = None  # Progress where the car stops rolling back
+        self.reversed_at = 0  # Progress where the car last rolled back
+        self.max_lap = 0  # Laps aren't lost by rolling back over the line
+        self.rand = rand
+        self.best_lap = 0
+        self.last_lap = 0
+        self.lap_start = 0.0  # Session time at which the current lap started
+        self.lap_time = self._next_lap_time(int(progress))
+        self.position = index + 1
+
+    @property
+    def lap(self):
+        return max(0, int(self.progress // 1), self.max_lap)
+
+    @property
+    def spline_pos(self):
+        return self.progress % 1
+
+    @property
+    def in_pit(self):
+        '''
+        The car is in the pit lane at the end of its pit lap and the start
+        of the following one
+        '''
+        if not self.pit_every:
+            return False
+        lap = self.lap
+        return (lap % self.pit_every == self.pit_every - 1 and
+                self.spline_pos > 0.97) or \
+            (lap % self.pit_every == 0 and lap > 0 and self.spline_pos < 0.02)
+
+    def _next_lap_time(self, lap):
+        lap_time = self.pace * (1 + self.rand.gauss(0, 0.004))
+        if self.pit_every and lap % self.pit_every == self.pit_every - 1:
+            lap_time += 25
+        return lap_time
+
+    def step(self, dt, now):
+        if self.reverse_end is not None:
+            self.progress -= dt / self.lap_time * REVERSE_SPEED
+            if self.progress <= self.reverse_end:
+                self.reverse_end = None
+            return
+
+        lap = self.lap
+        previous = self.progress
+        self.progress += dt / self.lap_time
+        if self.reverse_every and lap > 0 and lap % self.reverse_every == 0:
+            base = previous // 1
+            for start, end in REVERSALS:
+                if previous < base + start <= self.progress and \
+                        base + start > self.reversed_at:
+                    self.reverse_end = base + end
+                    self.reversed_at = base + start
+        self.max_lap = max(self.max_lap, int(self.progress // 1))
+        if self.lap != lap and self.progress > 0:
+            last_lap = int((now - self.lap_start) * 1000)
+            if lap > 0 or self.lap_start > 0:
+                self.last_lap = last_lap
+                if not self.best_lap or last_lap < self.best_lap:
+                    self.best_lap = last_lap
+            self.lap_start = now
+            self.lap_time = self._next_lap_time(self.lap)
+
+
+class Race(object):
+    '''
+    A synthetic session driving the given acstub.Sim
+    '''
+    def __init__(self, sim, cars=24, session_type=RACE, laps=30,
+                 track_length=5000.0, lap_time=90.0, elapsed=0.0,
+                 pit_every=0, seed=0, reverse_every=0):
+        self.sim = sim
+        self.rand = random.Random(seed)
+        self.session_type = session_type
+        self.laps = laps
+        self.track_length = track_length
+        self.now = elapsed
+        self.duration = laps * lap_time * 1.1  # Used for timed sessions
+        self.cars = []
+
+        for i in range(cars):
+            pace = lap_time * CLASSES[i * len(CLASSES) // cars] * \
+                (1 + self.rand.gauss(0, 0.01))
+            name = '%s %s' % (self.rand.choice(FIRST_NAMES),
+                              self.rand.choice(LAST_NAMES))
+            # Cars start behind the line in grid order, then cover the
+            # elapsed time at their own pace
+            progress = -0.002 * (i + 1) + elapsed / pace
+            if pit_every:
+                car_pit_every = pit_every + self.rand.randint(-2, 2)
+            else:
+                car_pit_every = 0
+            self.cars.append(SynthCar(i, name, pace, progress, car_pit_every,
+                                      self.rand, reverse_every))
+
+        sim.cars_count = cars
+        sim.graphics.session = session_type
+        sim.graphics.status = 2  # LIVE
+        sim.graphics.numberOfLaps = laps if session_type == RACE else 0
+        sim.physics.fuel = 60.0
+        sim.static.numCars = cars
+        sim.static.track = 'synth'
+        sim.static.carModel = 'synth_car'
+        sim.static.trackSPlineLength = track_length
+        self._update_sim()
+
+    def _update_positions(self):
+        if self.session_type == RACE:
+            ordered = sorted(self.cars, key=lambda car: -car.progress)
+        else:
+            ordered = sorted(self.cars, key=lambda car: (
+                not car.best_lap, car.best_lap, car.index))
+        for i, car in enumerate(ordered):
+            car.position = i + 1
+
+    def _update_sim(self):
+        sim = self.sim
+        for car in self.cars:
+            sim.set_car(car.index, name=car.name, spline_pos=car.spline_pos,
+                        lap=car.lap, best_lap=car.best_lap,
+                        position=car.position, in_pit=int(car.in_pit))
+
+        player = self.cars[0]
+        graphics = sim.graphics
+        graphics.packetId += 1
+        graphics.completedLaps = player.lap
+        graphics.iCurrentTime = int((self.now - player.lap_start) * 1000)
+        graphics.iLastTime = player.last_lap
+        graphics.normalizedCarPosition = player.spline_pos
+        graphics.distanceTraveled = max(0, player.progress) * \
+            self.track_length
+        graphics.isInPit = int(player.in_pit)
+        if self.session_type != RACE:
+            graphics.sessionTimeLeft = max(0, self.duration - self.now) * 1000
+        sim.physics.packetId += 1
+        sim.physics.pitLimiterOn = int(player.in_pit)
+        if player.in_pit:
+            sim.physics.fuel = 60.0
+        else:
+            sim.physics.fuel -= 0.03 / 60
+
+    def step(self, dt):
+        '''
+        Advance the session by dt seconds
+        '''
+        self.now += dt
+        for car in self.cars:
+            car.step(dt, self.now)
+        self._update_positions()
+        self._update_sim()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Generate a synthetic session recording')
+    parser.add_argument('--cars', type=int, default=24)
+    parser.add_argument('--laps', type=int, default=5)
+    parser.add_argument('--quali', action='store_true',
+                        help='generate a qualifying session')
+    parser.add_argument('--pit-every', type=int, default=0,
+                        help='average number of laps between pit stops')
+    parser.add_argument('--reverse-every', type=int, default=0,
+                        help='number of laps between the cars rolling back '
+                        'over a sector\'s start and over the finish line')
+    parser.add_argument('--fps', type=int, default=60)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', required=True)
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output)
+    sim = acstub.Sim()
+    pitboard = acstub.load_pitboard(sim)
+    race = Race(sim, cars=args.cars, laps=args.laps,
+                session_type=QUALIFY if args.quali else RACE,
+                pit_every=args.pit_every, seed=args.seed,
+                reverse_every=args.reverse_every)
+
+    recorder = pitboard.Recorder(output)
+    dt = 1.0 / args.fps
+    while race.cars[0].lap < args.laps:
+        race.step(dt)
+        recorder.record_frame(dt)
+    recorder.close()
+
+
+if __name__ == '__main__':
+    main()